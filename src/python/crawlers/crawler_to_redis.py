@@ -5,13 +5,22 @@ Reads repos from Elasticsearch and enqueues them to Redis for processing
 """
 
 import os
-import json
+import re
 import logging
 import time
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+import numpy as np
+import orjson
 import redis
 from elasticsearch import Elasticsearch
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -19,58 +28,88 @@ class CrawlerAdapter:
     """Adapts Elasticsearch crawler output to Redis queue"""
 
     def __init__(self):
-        # Redis connection
+        # Redis connection (raw bytes so msgpack payloads round-trip untouched)
         self.redis_client = redis.Redis(
             host=os.getenv("REDIS_HOST", "redis"),
             port=int(os.getenv("REDIS_PORT", "6379")),
             db=0,
-            decode_responses=True
+            decode_responses=False
         )
 
         # Elasticsearch connection
         es_url = os.getenv("ELASTICSEARCH_URL", "http://elasticsearch:9200")
         self.es = Elasticsearch([es_url])
+        self.es_index = "github-coding-repos"
 
         self.queue_name = "pipeline:repos"
         self.processed_set = "pipeline:processed:repos"
+        self.pipeline_flush_size = 1000
+        self.rpush_batch_size = 500
+
+        # One background writer sends RPUSH chunks while the next chunk is serialized;
+        # a single thread keeps them in queue order
+        self._push_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_pushes = []
+        self.smembers_max = 1_000_000
+
+        # Continuous-mode pacing based on queue depth
+        self.queue_high_watermark = int(os.getenv("QUEUE_HIGH_WATERMARK", "100000"))
+        self.queue_low_watermark = int(os.getenv("QUEUE_LOW_WATERMARK", "1000"))
+        self.min_sync_interval = 60
+        self.max_sync_interval = int(os.getenv("SYNC_INTERVAL_MAX", "14400"))
+        self.queue_poll_interval = 30
+
+        # Scoring lookups, built once rather than per repo
+        self._target_langs = frozenset([
+            'Rust', 'Go', 'Python', 'TypeScript', 'JavaScript', 'Dart'
+        ])
+        framework_keywords = [
+            'fastapi', 'django', 'flask', 'angular', 'react', 'vue',
+            'pytorch', 'tensorflow', 'tokio', 'actix', 'gin', 'fiber'
+        ]
+        self._framework_re = re.compile(
+            '|'.join(map(re.escape, framework_keywords)), re.IGNORECASE
+        )
+
+        # Queue payload format: "msgpack" (compact, fast) or "json" (readable)
+        self.serializer = os.getenv("SERIALIZER", "msgpack")
+        if self.serializer == "msgpack" and not MSGPACK_AVAILABLE:
+            logger.warning("msgpack not installed, falling back to JSON payloads")
+            self.serializer = "json"
 
         logger.info(f"Crawler Adapter initialized")
         logger.info(f"Elasticsearch: {es_url}")
         logger.info(f"Redis: {os.getenv('REDIS_HOST', 'redis')}")
+        logger.info(f"Queue serializer: {self.serializer}")
+
+    def _serialize_job(self, job: Dict):
+        """Serialize a job for the Redis queue"""
+        if self.serializer == "msgpack":
+            return msgpack.packb(job, use_bin_type=True)
+        return orjson.dumps(job)
 
     def fetch_repos_from_elasticsearch(self, batch_size: int = 1000) -> List[Dict]:
         """Fetch repositories from Elasticsearch"""
         logger.info("Fetching repos from Elasticsearch...")
 
-        query = {
-            "query": {
-                "match_all": {}
-            },
-            "sort": [
-                {"stars": {"order": "desc"}},
-                {"crawled_at": {"order": "desc"}}
-            ],
-            "size": batch_size
-        }
-
         try:
-            response = self.es.search(
-                index="github-coding-repos",
-                body=query,
-                scroll='5m'
-            )
-
-            repos = []
-            scroll_id = response['_scroll_id']
-            hits = response['hits']['hits']
-
-            while hits:
-                for hit in hits:
-                    repos.append(hit['_source'])
-
-                # Get next batch
-                response = self.es.scroll(scroll_id=scroll_id, scroll='5m')
-                hits = response['hits']['hits']
+            num_slices = self._get_num_slices()
+            if num_slices > 1:
+                repos = self._fetch_sliced(num_slices, batch_size)
+            else:
+                # Page with search_after on a unique keyword rather than holding a
+                # scroll context open; enqueue_repos orders the queue by score
+                query = {
+                    "query": {
+                        "match_all": {}
+                    },
+                    "sort": [
+                        {"full_name": "asc"}
+                    ],
+                    "size": batch_size,
+                    "track_total_hits": False
+                }
+                repos = self._paginate(query, index=self.es_index)
 
             logger.info(f"Fetched {len(repos)} repos from Elasticsearch")
             return repos
@@ -79,74 +118,203 @@ class CrawlerAdapter:
             logger.error(f"Error fetching from Elasticsearch: {e}")
             return []
 
+    def _get_num_slices(self) -> int:
+        """Number of parallel fetch slices (defaults to the index shard count)"""
+        env_slices = os.getenv("ES_FETCH_SLICES")
+        if env_slices:
+            return max(1, int(env_slices))
+
+        try:
+            settings = self.es.indices.get_settings(index=self.es_index)
+            index_settings = next(iter(settings.values()))
+            return int(index_settings['settings']['index']['number_of_shards'])
+        except Exception as e:
+            logger.warning(f"Could not read shard count, using a single slice: {e}")
+            return 1
+
+    def _paginate(self, query: Dict, index: Optional[str] = None) -> List[Dict]:
+        """Follow search_after cursors until a short page is returned"""
+        repos = []
+        batch_size = query["size"]
+
+        while True:
+            response = self.es.search(index=index, body=query)
+            hits = response['hits']['hits']
+
+            for hit in hits:
+                repos.append(hit['_source'])
+
+            if len(hits) < batch_size:
+                return repos
+
+            # terminate_after only holds for the first page of an index-order sort
+            query.pop("terminate_after", None)
+            query["search_after"] = hits[-1]['sort']
+
+    def _fetch_sliced(self, num_slices: int, batch_size: int) -> List[Dict]:
+        """Fetch all slices of a point-in-time concurrently"""
+        pit_id = self.es.open_point_in_time(index=self.es_index, keep_alive="5m")['id']
+
+        def fetch_slice(slice_id: int) -> List[Dict]:
+            query = {
+                "query": {
+                    "match_all": {}
+                },
+                "pit": {"id": pit_id, "keep_alive": "5m"},
+                "slice": {"id": slice_id, "max": num_slices},
+                "sort": [
+                    {"_shard_doc": "asc"}
+                ],
+                "size": batch_size,
+                "track_total_hits": False,
+                # _shard_doc is index order, so the first page is the first
+                # batch_size docs each shard sees; stop collecting there
+                "terminate_after": batch_size
+            }
+            return self._paginate(query)
+
+        try:
+            repos = []
+            with ThreadPoolExecutor(max_workers=num_slices) as executor:
+                for slice_repos in executor.map(fetch_slice, range(num_slices)):
+                    repos.extend(slice_repos)
+            logger.info(f"Fetched {num_slices} slices in parallel")
+            return repos
+        finally:
+            # Release the PIT now instead of letting it pin segments until
+            # keep_alive expires; a failed close must not discard the results
+            try:
+                self.es.close_point_in_time(id=pit_id)
+            except Exception as e:
+                logger.warning(f"Failed to close point in time: {e}")
+
     def enqueue_repos(self, repos: List[Dict]) -> int:
         """Enqueue repos to Redis"""
         enqueued = 0
 
-        for repo in repos:
-            full_name = repo.get('full_name', '')
+        names = [repo.get('full_name', '') for repo in repos]
+        processed = self._check_processed(names)
+
+        # Score all unprocessed repos in one vectorized pass
+        candidates = [
+            (repo, full_name)
+            for repo, full_name, is_processed in zip(repos, names, processed)
+            if not is_processed
+        ]
+        scores = self._calculate_quality_scores([repo for repo, _ in candidates])
+
+        # Repos arrive in full_name order; queue the best first, most-starred among equal
+        # scores, so consumers still drain the strongest repos first
+        stars = np.fromiter((repo.get('stars', 0) for repo, _ in candidates), dtype=np.int64, count=len(candidates))
+        order = np.lexsort((-stars, -scores)).tolist()
+        scores = scores.tolist()
 
-            # Skip if already processed
-            if self.redis_client.sismember(self.processed_set, full_name):
+        buffer = []
+
+        for idx in order:
+            repo, full_name = candidates[idx]
+            quality_score = scores[idx]
+            # Only enqueue if quality is good enough
+            if quality_score < 50:
                 continue
 
             # Create job
             job = {
-                'repo_url': repo.get('url', '').replace('https://github.com/', 'https://github.com/') + '.git',
+                'repo_url': repo.get('url', '') + '.git',
                 'full_name': full_name,
                 'stars': repo.get('stars', 0),
                 'forks': repo.get('forks', 0),
                 'language': repo.get('language', 'Unknown'),
-                'quality_score': self._calculate_quality_score(repo),
+                'quality_score': quality_score,
                 'topics': repo.get('topics', [])
             }
 
-            # Only enqueue if quality is good enough
-            if job['quality_score'] >= 50:
-                self.redis_client.rpush(self.queue_name, json.dumps(job))
-                enqueued += 1
+            buffer.append(self._serialize_job(job))
+            enqueued += 1
 
-                if enqueued % 100 == 0:
-                    logger.info(f"Enqueued {enqueued} repos...")
+            # One variadic RPUSH per chunk instead of one command per job
+            if len(buffer) >= self.rpush_batch_size:
+                self._submit_push(buffer)
+                buffer = []
+                logger.info(f"Enqueued {enqueued} repos...")
 
+        if buffer:
+            self._submit_push(buffer)
+
+        # Pushes drain in the background; callers flush() before relying on them
         logger.info(f"Total enqueued: {enqueued} repos")
         return enqueued
 
-    def _calculate_quality_score(self, repo: Dict) -> int:
-        """Calculate repository quality score"""
-        score = 0
+    def _submit_push(self, payloads: List):
+        """Hand a chunk of payloads to the background writer"""
+        self._pending_pushes.append(
+            self._push_executor.submit(self.redis_client.rpush, self.queue_name, *payloads)
+        )
+
+    def flush(self) -> int:
+        """Wait for background pushes to finish; returns the number that failed"""
+        pending, self._pending_pushes = self._pending_pushes, []
+        failed = 0
+
+        for push in pending:
+            try:
+                push.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Failed to push jobs to Redis: {e}")
+
+        return failed
+
+    def _check_processed(self, names: List[str]) -> List[bool]:
+        """Check processed status for many repos in a single round trip"""
+        processed_count = self.redis_client.scard(self.processed_set)
+        if processed_count == 0:
+            return [False] * len(names)
+
+        # When the processed set is the smaller side, pull it once and filter
+        # locally instead of sending every name to the server
+        if processed_count < min(len(names), self.smembers_max):
+            members = self.redis_client.smembers(self.processed_set)
+            return [name.encode() in members for name in names]
+
+        # Split SMISMEMBER into bounded chunks so one huge command can't stall
+        # the Redis event loop, but send them all in one pipeline flush
+        pipe = self.redis_client.pipeline(transaction=False)
+        for i in range(0, len(names), self.pipeline_flush_size):
+            pipe.smismember(self.processed_set, names[i:i + self.pipeline_flush_size])
+
+        processed = []
+        for chunk in pipe.execute():
+            processed.extend(chunk)
+        return processed
+
+    def _calculate_quality_scores(self, repos: List[Dict]) -> np.ndarray:
+        """Calculate quality scores for a batch of repositories"""
+        count = len(repos)
 
         # Stars
-        stars = repo.get('stars', 0)
-        if stars >= 100:
-            score += 30
-        elif stars >= 50:
-            score += 20
-        elif stars >= 10:
-            score += 10
+        stars = np.fromiter((repo.get('stars', 0) for repo in repos), dtype=np.int64, count=count)
+        score = np.select([stars >= 100, stars >= 50, stars >= 10], [30, 20, 10], default=0)
 
         # Forks
-        forks = repo.get('forks', 0)
-        if forks >= 20:
-            score += 20
-        elif forks >= 10:
-            score += 15
-        elif forks >= 3:
-            score += 10
+        forks = np.fromiter((repo.get('forks', 0) for repo in repos), dtype=np.int64, count=count)
+        score += np.select([forks >= 20, forks >= 10, forks >= 3], [20, 15, 10], default=0)
 
         # Language
-        target_languages = ['Rust', 'Go', 'Python', 'TypeScript', 'JavaScript', 'Dart']
-        if repo.get('language') in target_languages:
-            score += 30
-
-        # Topics (frameworks, etc.)
-        topics = repo.get('topics', [])
-        framework_keywords = [
-            'fastapi', 'django', 'flask', 'angular', 'react', 'vue',
-            'pytorch', 'tensorflow', 'tokio', 'actix', 'gin', 'fiber'
-        ]
-        if any(keyword in ' '.join(topics).lower() for keyword in framework_keywords):
-            score += 20
+        is_target = np.fromiter(
+            (repo.get('language') in self._target_langs for repo in repos),
+            dtype=bool, count=count
+        )
+        score += 30 * is_target
+
+        # Topics (frameworks, etc.); match each topic directly instead of
+        # building a lowercased joined string per repo
+        framework_search = self._framework_re.search
+        has_framework = np.fromiter(
+            (any(map(framework_search, repo.get('topics', []))) for repo in repos),
+            dtype=bool, count=count
+        )
+        score += 20 * has_framework
 
         return score
 
@@ -154,8 +322,13 @@ class CrawlerAdapter:
         """Continuously sync repos from Elasticsearch to Redis"""
         logger.info(f"Starting continuous sync (interval: {interval_seconds}s)")
 
+        interval = interval_seconds
+
         while True:
             try:
+                # Settle the previous cycle's pushes before starting another
+                self.flush()
+
                 logger.info("Starting sync cycle...")
 
                 # Fetch repos from Elasticsearch
@@ -173,17 +346,40 @@ class CrawlerAdapter:
                 processed = self.redis_client.scard(self.processed_set)
                 logger.info(f"Queue status: {queue_len} pending, {processed} processed")
 
+                # Back off while consumers are behind, speed up when starved
+                if queue_len > self.queue_high_watermark:
+                    interval = min(self.max_sync_interval, interval * 2)
+                elif queue_len < self.queue_low_watermark:
+                    interval = max(self.min_sync_interval, interval // 2)
+
                 # Wait before next sync
-                logger.info(f"Sleeping for {interval_seconds}s...")
-                time.sleep(interval_seconds)
+                logger.info(f"Sleeping for up to {interval}s...")
+                self._wait_for_next_cycle(interval, queue_len)
 
             except KeyboardInterrupt:
                 logger.info("Shutting down...")
+                self.flush()
                 break
             except Exception as e:
                 logger.error(f"Error in sync cycle: {e}", exc_info=True)
                 time.sleep(60)
 
+    def _wait_for_next_cycle(self, timeout: int, queue_len: int):
+        """Sleep until the timeout, waking early if the queue drains"""
+        deadline = time.monotonic() + timeout
+        watch_drain = queue_len >= self.queue_low_watermark
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            time.sleep(min(self.queue_poll_interval, remaining))
+
+            if watch_drain and self.redis_client.llen(self.queue_name) < self.queue_low_watermark:
+                logger.info("Queue drained, starting next sync early")
+                return
+
 def main():
     """Main entry point"""
     adapter = CrawlerAdapter()
@@ -199,6 +395,7 @@ def main():
         repos = adapter.fetch_repos_from_elasticsearch()
         if repos:
             enqueued = adapter.enqueue_repos(repos)
+            adapter.flush()
             logger.info(f"One-time sync complete: {enqueued} repos enqueued")
         else:
             logger.warning("No repos to enqueue")
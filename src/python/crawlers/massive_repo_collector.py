@@ -5,13 +5,31 @@ Massive repository collector - designed to pull thousands of repos
 
 import requests
 import time
-import json
+import orjson
 import threading
 from datetime import datetime, timedelta
-from typing import List, Set
+from typing import Iterator, List, Set
 import queue
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import random
+from itertools import count, islice
+
+GITHUB_SEARCH_URL = "https://api.github.com/search/repositories"
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+
+# One GraphQL round trip returns the search page together with repo topics
+SEARCH_REPOS_GRAPHQL = """
+query($q: String!) {
+  search(query: $q, type: REPOSITORY, first: 100) {
+    nodes {
+      ... on Repository {
+        url
+        repositoryTopics(first: 10) { nodes { topic { name } } }
+      }
+    }
+  }
+}
+"""
 
 class GitHubRateLimiter:
     """Smart rate limiter for GitHub API"""
@@ -29,6 +47,30 @@ class GitHubRateLimiter:
         self.unauthenticated_delay = 61  # 1 request per minute without token
         self.max_retry_attempts = 3
         self.backoff_multiplier = 2
+
+        # AIMD concurrency window: +0.5 per success, halved under pressure
+        self.min_concurrency = 1
+        self.max_concurrency = 3 if github_token else 1
+        self.concurrency = float(self.min_concurrency)
+        self.in_flight = 0
+        self.concurrency_cond = threading.Condition()
+
+    def acquire_slot(self):
+        """Block until the current concurrency window has room"""
+        with self.concurrency_cond:
+            while self.in_flight >= int(self.concurrency):
+                self.concurrency_cond.wait()
+            self.in_flight += 1
+
+    def release_slot(self, status_code: int = None):
+        """Release a slot and adapt the window to the response"""
+        with self.concurrency_cond:
+            self.in_flight -= 1
+            if status_code in (200, 304):
+                self.concurrency = min(self.max_concurrency, self.concurrency + 0.5)
+            elif status_code is None or status_code in (403, 429) or status_code >= 500:
+                self.concurrency = max(self.min_concurrency, self.concurrency * 0.5)
+            self.concurrency_cond.notify_all()
     
     def wait_if_needed(self):
         """Wait if we need to respect rate limits"""
@@ -85,8 +127,20 @@ class MassiveRepoCollector:
         }
         # Remove None values
         self.headers = {k: v for k, v in self.headers.items() if v is not None}
+
+        # Shared session so every query reuses pooled keep-alive connections
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=32)
+        self.session.mount("https://", adapter)
         
         self.collected_repos = set()
+        self.collected_lock = threading.Lock()
+        self.repo_topics = {}  # repo URL -> topics seen in search results
+        
+        # ETag cache for REST searches; 304 replies don't spend rate limit
+        self.search_cache_file = "github_search_cache.json"
+        self.search_cache = self._load_search_cache()
         self.repo_queue = queue.Queue()
         self.rate_limiter = GitHubRateLimiter(github_token)
         
@@ -157,6 +211,67 @@ class MassiveRepoCollector:
             "react-native", "ionic", "electron", "cordova", "unity", "unreal"
         ]
     
+    def _load_search_cache(self) -> dict:
+        """Load cached ETags and results from a previous run"""
+        try:
+            with open(self.search_cache_file, "rb") as f:
+                return orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return {}
+    
+    def _save_search_cache(self):
+        """Persist cached ETags and results for the next run"""
+        with open(self.search_cache_file, "wb") as f:
+            f.write(orjson.dumps(self.search_cache))
+    
+    def _search_page(self, query: str):
+        """Fetch the top 100 results as (response, [(repo_url, topics), ...])"""
+        # GraphQL needs auth; fall back to REST without a token or on 5xx
+        if self.github_token:
+            response = self.session.post(
+                GITHUB_GRAPHQL_URL,
+                json={
+                    "query": SEARCH_REPOS_GRAPHQL,
+                    "variables": {"q": f"{query} sort:stars-desc"}
+                },
+                timeout=30
+            )
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                if not data.get("errors"):
+                    return response, [
+                        (node["url"], [t["topic"]["name"] for t in node["repositoryTopics"]["nodes"]])
+                        for node in data["data"]["search"]["nodes"]
+                        if node
+                    ]
+            elif response.status_code < 500:
+                return response, []
+
+        params = {
+            "q": query,
+            "sort": "stars", 
+            "order": "desc",
+            "per_page": 100
+        }
+        headers = {}
+        cached = self.search_cache.get(query)
+        if cached:
+            headers["If-None-Match"] = cached["etag"]
+        
+        response = self.session.get(GITHUB_SEARCH_URL, params=params, headers=headers, timeout=30)
+        if response.status_code == 304:
+            return response, [tuple(result) for result in cached["results"]]
+        if response.status_code != 200:
+            return response, []
+        
+        results = [
+            (repo["html_url"], repo.get("topics", []))
+            for repo in orjson.loads(response.content).get("items", [])
+        ]
+        if response.headers.get("ETag"):
+            self.search_cache[query] = {"etag": response.headers["ETag"], "results": results}
+        return response, results
+    
     def search_single_query_with_retry(self, query: str) -> Set[str]:
         """Search single query with exponential backoff and proper rate limiting"""
         found_repos = set()
@@ -166,29 +281,26 @@ class MassiveRepoCollector:
                 # Wait for rate limit
                 self.rate_limiter.wait_if_needed()
                 
-                params = {
-                    "q": query,
-                    "sort": "stars", 
-                    "order": "desc",
-                    "per_page": 100
-                }
-                
-                response = requests.get(
-                    "https://api.github.com/search/repositories",
-                    params=params,
-                    headers=self.headers,
-                    timeout=30
-                )
+                status_code = None
+                self.rate_limiter.acquire_slot()
+                try:
+                    response, results = self._search_page(query)
+                    status_code = response.status_code
+                finally:
+                    self.rate_limiter.release_slot(status_code)
                 
                 # Update rate limit info
                 self.rate_limiter.update_rate_limit_info(response)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    for repo in data.get("items", []):
-                        repo_url = repo["html_url"]
-                        if repo_url not in self.collected_repos:
-                            found_repos.add(repo_url)
+                if response.status_code in (200, 304):
+                    # Claim new URLs atomically so concurrent queries don't
+                    # report the same repo twice
+                    with self.collected_lock:
+                        for repo_url, topics in results:
+                            self.repo_topics[repo_url] = topics
+                            if repo_url not in self.collected_repos:
+                                self.collected_repos.add(repo_url)
+                                found_repos.add(repo_url)
                     
                     print(f"✅ Query '{query[:40]}...' found {len(found_repos)} repos (attempt {attempt+1})")
                     return found_repos
@@ -246,8 +358,10 @@ class MassiveRepoCollector:
         """Search repositories with proper rate limiting"""
         repos = set()
         
-        # Limit parallelism based on token availability
+        # Limit parallelism based on token availability; the rate limiter's
+        # AIMD window decides how many of these workers may be in flight
         max_workers = self.parallel_searches
+        self.rate_limiter.max_concurrency = max_workers
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_query = {
@@ -271,40 +385,49 @@ class MassiveRepoCollector:
         
         return repos
     
-    def generate_massive_search_queries(self) -> List[str]:
-        """Generate hundreds of search queries for maximum coverage"""
-        queries = []
+    def generate_massive_search_queries(self) -> Iterator[str]:
+        """Lazily yield unique search queries for maximum coverage"""
+        seen = set()
+        for query in self._candidate_search_queries():
+            if query in seen:
+                continue
+            seen.add(query)
+            yield query
+
+        print(f"Generated {len(seen)} unique search queries")
+
+    def _candidate_search_queries(self) -> Iterator[str]:
+        """Yield raw search queries, possibly with duplicates"""
+        # Searches only read the first page sorted by stars, so a higher star
+        # threshold on the same qualifier returns the same top 100 and is omitted
         
         # Language-based searches
         for lang in self.all_languages:
-            queries.extend([
+            yield from (
                 f"language:{lang} stars:>100",
-                f"language:{lang} stars:>500", 
-                f"language:{lang} stars:>1000",
                 f"language:{lang} pushed:>2023-01-01",
                 f"language:{lang} created:>2022-01-01",
                 f"language:{lang} forks:>50"
-            ])
+            )
         
         # Topic-based searches
         for topic in self.all_topics:
-            queries.extend([
+            yield from (
                 f"topic:{topic} stars:>50",
-                f"topic:{topic} stars:>200",
                 f"topic:{topic} language:Python",
                 f"topic:{topic} language:JavaScript",
                 f"topic:{topic} language:TypeScript"
-            ])
+            )
         
         # Combination searches
         for i, lang1 in enumerate(self.all_languages[:10]):
             for lang2 in self.all_languages[i+1:11]:
-                queries.append(f"language:{lang1} OR language:{lang2} stars:>100")
+                yield f"language:{lang1} OR language:{lang2} stars:>100"
         
         # NSFW-specific searches
         nsfw_keywords = ["nsfw", "adult", "porn", "xxx", "cam", "escort", "dating", "hookup"]
         for keyword in nsfw_keywords:
-            queries.extend([
+            yield from (
                 f"{keyword} language:Python stars:>1",
                 f"{keyword} language:JavaScript stars:>1",
                 f"{keyword} language:PHP stars:>1",
@@ -313,7 +436,7 @@ class MassiveRepoCollector:
                 f"in:name {keyword}",
                 f"in:description {keyword}",
                 f"in:readme {keyword}"
-            ])
+            )
         
         # Time-based searches for recent activity
         time_ranges = [
@@ -325,15 +448,15 @@ class MassiveRepoCollector:
         
         for time_range in time_ranges:
             for lang in self.all_languages[:20]:  # Top 20 languages
-                queries.append(f"language:{lang} {time_range} stars:>10")
+                yield f"language:{lang} {time_range} stars:>10"
         
         # Size-based searches
         size_ranges = ["<1000", "1000..10000", "10000..100000", ">100000"]
         for size_range in size_ranges:
-            queries.extend([
+            yield from (
                 f"size:{size_range} stars:>100 language:Python",
                 f"size:{size_range} stars:>100 language:JavaScript"
-            ])
+            )
         
         # Organization searches (popular orgs)
         popular_orgs = [
@@ -343,14 +466,11 @@ class MassiveRepoCollector:
         ]
         
         for org in popular_orgs:
-            queries.extend([
+            yield from (
                 f"user:{org} stars:>10",
                 f"user:{org} language:Python",
                 f"user:{org} language:JavaScript"
-            ])
-        
-        print(f"Generated {len(queries)} search queries")
-        return queries
+            )
     
     def discover_repo_networks(self, seed_repos: List[str]) -> Set[str]:
         """Discover repositories through network effects with rate limiting"""
@@ -358,46 +478,47 @@ class MassiveRepoCollector:
         
         for repo_url in seed_repos[:30]:  # Reduced to avoid hitting limits
             try:
-                # Extract owner/repo
-                parts = repo_url.replace('https://github.com/', '').split('/')
-                if len(parts) < 2:
-                    continue
-                owner, repo = parts[0], parts[1]
-                
-                # Rate limit before API call
-                self.rate_limiter.wait_if_needed()
+                # Topics usually came back with the search results already
+                topics = self.repo_topics.get(repo_url)
                 
-                # Get repository info
-                repo_api_url = f"https://api.github.com/repos/{owner}/{repo}"
-                response = requests.get(
-                    repo_api_url, 
-                    headers=self.headers,
-                    timeout=30
-                )
-                
-                # Update rate limit info
-                self.rate_limiter.update_rate_limit_info(response)
-                
-                if response.status_code == 200:
-                    repo_data = response.json()
+                if topics is None:
+                    # Extract owner/repo
+                    parts = repo_url.replace('https://github.com/', '').split('/')
+                    if len(parts) < 2:
+                        continue
+                    owner, repo = parts[0], parts[1]
                     
-                    # Search for similar repositories using topics
-                    if repo_data.get("topics"):
-                        for topic in repo_data["topics"][:2]:  # Top 2 topics only
-                            similar_query = f"topic:{topic} stars:>50"
-                            similar_repos = self.search_single_query_with_retry(similar_query)
-                            discovered.update(similar_repos)
-                            
-                            if len(discovered) > 200:  # Limit network discovery
-                                break
-                
-                elif response.status_code == 403:
-                    print(f"🚫 Rate limited during network discovery")
-                    break  # Stop network discovery if rate limited
+                    # Rate limit before API call
+                    self.rate_limiter.wait_if_needed()
+                    
+                    # Get repository info
+                    repo_api_url = f"https://api.github.com/repos/{owner}/{repo}"
+                    response = self.session.get(
+                        repo_api_url,
+                        timeout=30
+                    )
+                    
+                    # Update rate limit info
+                    self.rate_limiter.update_rate_limit_info(response)
+                    
+                    if response.status_code == 403:
+                        print(f"🚫 Rate limited during network discovery")
+                        break  # Stop network discovery if rate limited
+                    
+                    elif response.status_code == 404:
+                        print(f"⚠️  Repository not found: {repo_url}")
+                        continue
+                    
+                    topics = orjson.loads(response.content).get("topics", []) if response.status_code == 200 else []
                 
-                elif response.status_code == 404:
-                    print(f"⚠️  Repository not found: {repo_url}")
-                    continue
+                # Search for similar repositories using topics
+                for topic in topics[:2]:  # Top 2 topics only
+                    similar_query = f"topic:{topic} stars:>50"
+                    similar_repos = self.search_single_query_with_retry(similar_query)
+                    discovered.update(similar_repos)
+                    
+                    if len(discovered) > 200:  # Limit network discovery
+                        break
                 
                 print(f"🕸️  Network discovery from {repo_url}: +{len(discovered)} total repos")
                 
@@ -421,9 +542,11 @@ class MassiveRepoCollector:
         
         # Process queries in batches
         batch_size = 50
-        for i in range(0, len(search_queries), batch_size):
-            batch = search_queries[i:i+batch_size]
-            print(f"\nProcessing search batch {i//batch_size + 1}/{len(search_queries)//batch_size + 1}")
+        for batch_num in count(1):
+            batch = list(islice(search_queries, batch_size))
+            if not batch:
+                break
+            print(f"\nProcessing search batch {batch_num}")
             
             batch_repos = self.search_repositories_parallel(batch)
             all_repos.update(batch_repos)
@@ -449,8 +572,9 @@ class MassiveRepoCollector:
         print(f"📊 Final count: {len(final_repos):,} repositories")
         
         # Save to file
-        with open("massive_repo_collection.json", "w") as f:
-            json.dump(final_repos, f, indent=2)
+        with open("massive_repo_collection.json", "wb") as f:
+            f.write(orjson.dumps(final_repos, option=orjson.OPT_INDENT_2))
+        self._save_search_cache()
         
         return final_repos
 
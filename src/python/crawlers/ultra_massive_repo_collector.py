@@ -4,21 +4,89 @@ Ultra Massive Repository Collector - Designed to collect 1 million+ repositories
 Advanced multi-source, multi-strategy collection system
 """
 
-import requests
+import argparse
 import time
-import json
+import orjson
 import threading
 import asyncio
 import aiohttp
 from datetime import datetime, timedelta
-from typing import List, Set, Dict, Any
+from typing import List, Set, Dict, Any, Optional, Iterator
 import queue
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import random
 import hashlib
 import sqlite3
 from pathlib import Path
 import os
+import atexit
+import heapq
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+
+try:
+    from pybloom_live import ScalableBloomFilter
+    BLOOM_AVAILABLE = True
+except ImportError:
+    BLOOM_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+try:
+    import zstandard as zstd
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+GITHUB_SEARCH_URL = "https://api.github.com/search/repositories"
+SEARCH_PER_PAGE = 100
+SEARCH_RESULT_CAP = 1000  # GitHub search never serves results past this
+SEARCH_MAX_PAGES = SEARCH_RESULT_CAP // SEARCH_PER_PAGE
+
+REPO_INSERT_WIDTH = 10
+_INSERT_SQL = ("INSERT OR IGNORE INTO repositories "
+               "(url, name, owner, stars, forks, language, topics, created_at, updated_at, size) VALUES ")
+_INSERT_ROW = "(" + ",".join(["?"] * REPO_INSERT_WIDTH) + ")"
+EXPORT_SUFFIX_FORMATS = {
+    ".ndjson": "ndjson", ".jsonl": "ndjson", ".parquet": "parquet",
+    ".sql": "sql", ".sqlite": "sqlite", ".db": "sqlite"
+}
+_EXPORT_SQL = ("SELECT url, name, owner, stars, forks, language, {topics}, "
+               "created_at, updated_at, size FROM repositories WHERE {where} ORDER BY stars DESC")
+# topics is stored as JSON text: fetched as raw bytes when it is spliced into JSON output
+# as-is, or tagged so the column converter below hands back a list at fetch time.
+# Converters are registered process-wide, so the tag is one no other sqlite3 user picks
+_TOPICS_CONVERTER = "umrc_json"
+_RAW_TOPICS = "CAST(topics AS BLOB)"
+_DECODED_TOPICS = f"COALESCE(topics, '[]') AS \"topics [{_TOPICS_CONVERTER}]\""
+sqlite3.register_converter(_TOPICS_CONVERTER, orjson.loads)
+# Indented exports are only for eyeballing small samples
+PRETTY_EXPORT_MAX_ROWS = 10_000
+EXPORT_FIELDS = ("url", "name", "owner", "stars", "forks", "language", "topics",
+                 "created_at", "updated_at", "size")
+# Search-page cache for conditional requests: only the fields we store are kept per item,
+# and rows are dropped once stale or past the cap so the cache stays small
+ETAG_CACHE_ITEM_FIELDS = ("html_url", "name", "stargazers_count", "forks_count", "language",
+                          "topics", "created_at", "updated_at", "size")
+ETAG_CACHE_TTL = 7 * 24 * 3600
+ETAG_CACHE_MAX_ROWS = 20_000
+ETAG_CACHE_PRUNE_EVERY = 1000
+
+@dataclass
+class TokenState:
+    """Rate-limit bookkeeping for one token, guarded by its own lock"""
+    remaining: int = 5000
+    reset_time: float = 0.0  # Unix epoch, to line up with X-RateLimit-Reset
+    last_request: float = 0.0  # time.monotonic()
+    consecutive_failures: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
 
 class AdvancedRateLimiter:
     """Ultra-sophisticated rate limiter for 1M+ repo collection"""
@@ -27,16 +95,15 @@ class AdvancedRateLimiter:
         self.github_tokens = github_tokens or []
         self.current_token_index = 0
         self.token_states = {}
-        self.lock = threading.Lock()
         
-        # Initialize token states
+        # Initialize token states (one lock per token, no global lock)
         for i, token in enumerate(self.github_tokens):
-            self.token_states[i] = {
-                'remaining': 5000,
-                'reset_time': time.time() + 3600,
-                'last_request': 0,
-                'consecutive_failures': 0
-            }
+            self.token_states[i] = TokenState(reset_time=time.time() + 3600)
+        
+        # Min-heap of (failing, -remaining, idx); entries are refreshed lazily on pop
+        self._heap_lock = threading.Lock()
+        self._token_heap = []
+        self._rebuild_heap()
         
         # Rate limiting configuration
         self.base_delay = 0.05  # 20 requests/second max per token
@@ -44,90 +111,177 @@ class AdvancedRateLimiter:
         self.backoff_multiplier = 1.5
         self.token_rotation_threshold = 100  # Switch tokens when < 100 requests
     
+    def _heap_key(self, idx: int) -> tuple:
+        state = self.token_states[idx]
+        return (state.consecutive_failures >= 3, -state.remaining, idx)
+    
+    def _rebuild_heap(self):
+        """Rebuild the token heap from current state (caller holds _heap_lock)"""
+        self._token_heap = [self._heap_key(idx) for idx in self.token_states]
+        heapq.heapify(self._token_heap)
+    
+    def _push_token(self, idx: int):
+        """Queue a fresh heap entry after a token's state changed"""
+        with self._heap_lock:
+            heapq.heappush(self._token_heap, self._heap_key(idx))
+            # Superseded entries pile up until popped; compact now and then
+            if len(self._token_heap) > 4 * len(self.token_states):
+                self._rebuild_heap()
+    
+    def _reset_expired_tokens(self) -> bool:
+        """Refill tokens whose reset time has passed; True if any were reset"""
+        current_time = time.time()
+        reset_any = False
+        for state in self.token_states.values():
+            if current_time >= state.reset_time:
+                with state.lock:
+                    if current_time >= state.reset_time:
+                        state.remaining = 5000
+                        state.reset_time = current_time + 3600
+                        state.consecutive_failures = 0
+                        reset_any = True
+        return reset_any
+    
     def get_best_token(self) -> tuple:
         """Get the token with the most remaining requests"""
         if not self.github_tokens:
             return None, None
         
-        best_token_idx = 0
-        best_remaining = -1
-        
-        current_time = time.time()
-        
-        for idx, state in self.token_states.items():
-            # Reset if time has passed
-            if current_time >= state['reset_time']:
-                state['remaining'] = 5000
-                state['reset_time'] = current_time + 3600
-                state['consecutive_failures'] = 0
-            
-            # Find token with most remaining requests
-            if state['remaining'] > best_remaining and state['consecutive_failures'] < 3:
-                best_remaining = state['remaining']
-                best_token_idx = idx
-        
-        return self.github_tokens[best_token_idx], best_token_idx
+        with self._heap_lock:
+            while True:
+                entry = self._token_heap[0]
+                current = self._heap_key(entry[2])
+                if entry != current:
+                    # Stale entry: replace it with the token's real priority and re-check
+                    heapq.heapreplace(self._token_heap, current)
+                    continue
+                
+                failing, neg_remaining, idx = entry
+                # Only when the best token is unusable do we pay for a full reset scan
+                if (failing or neg_remaining >= 0) and self._reset_expired_tokens():
+                    self._rebuild_heap()
+                    continue
+                
+                return self.github_tokens[idx], idx
     
     def wait_and_get_token(self):
         """Get a token and wait if necessary"""
-        with self.lock:
+        while True:
             token, token_idx = self.get_best_token()
             
             if token is None:
                 return None, None
             
             state = self.token_states[token_idx]
-            current_time = time.time()
             
             # If all tokens are exhausted, wait for the earliest reset
-            if state['remaining'] <= 0:
-                earliest_reset = min(s['reset_time'] for s in self.token_states.values())
-                wait_time = max(0, earliest_reset - current_time + 1)
+            if state.remaining <= 0:
+                earliest_reset = min(s.reset_time for s in self.token_states.values())
+                wait_time = max(0, earliest_reset - time.time() + 1)
                 if wait_time > 0:
                     print(f"🕐 All tokens exhausted, waiting {wait_time:.1f}s for reset")
                     time.sleep(wait_time)
-                    # Recursively try again
-                    return self.wait_and_get_token()
+                    continue
             
-            # Apply minimal delay with jitter
-            time_since_last = current_time - state['last_request']
-            min_delay = self.base_delay + random.uniform(0, 0.02)
-            if time_since_last < min_delay:
-                time.sleep(min_delay - time_since_last)
+            with state.lock:
+                # Apply minimal delay with jitter; reserve the slot now, sleep after unlocking
+                current_time = time.monotonic()
+                min_delay = self.base_delay + random.uniform(0, 0.02)
+                sleep_needed = max(0.0, state.last_request + min_delay - current_time)
+                state.last_request = current_time + sleep_needed
+                state.remaining -= 1
+            self._push_token(token_idx)
             
-            state['last_request'] = time.time()
-            state['remaining'] -= 1
+            if sleep_needed > 0:
+                time.sleep(sleep_needed)
             
             return token, token_idx
     
     def update_token_state(self, token_idx: int, response):
         """Update token state from response headers"""
-        if token_idx in self.token_states:
+        state = self.token_states.get(token_idx)
+        if state is None:
+            return
+        with state.lock:
             if response.headers.get('X-RateLimit-Remaining'):
-                self.token_states[token_idx]['remaining'] = int(response.headers['X-RateLimit-Remaining'])
+                state.remaining = int(response.headers['X-RateLimit-Remaining'])
             if response.headers.get('X-RateLimit-Reset'):
-                self.token_states[token_idx]['reset_time'] = int(response.headers['X-RateLimit-Reset'])
+                state.reset_time = int(response.headers['X-RateLimit-Reset'])
+        self._push_token(token_idx)
     
     def mark_token_failure(self, token_idx: int):
         """Mark a token as having failed"""
-        if token_idx in self.token_states:
-            self.token_states[token_idx]['consecutive_failures'] += 1
+        state = self.token_states.get(token_idx)
+        if state is None:
+            return
+        with state.lock:
+            state.consecutive_failures += 1
+        self._push_token(token_idx)
 
 class UltraMassiveRepoCollector:
     """Collect 1 million+ repositories using advanced strategies"""
     
-    def __init__(self, github_tokens: List[str] = None):
+    def __init__(self, github_tokens: List[str] = None, target_repos: int = 1_000_000,
+                 max_workers: Optional[int] = None):
         self.github_tokens = github_tokens or []
         self.rate_limiter = AdvancedRateLimiter(github_tokens)
         
         # Persistence layer
         self.db_path = "ultra_massive_repos.db"
+        # One long-lived connection in autocommit mode; transactions are explicit
+        # cached_statements covers every multi-row INSERT width (full chunks plus tails)
+        self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                                     cached_statements=256)
+        self._db_lock = threading.Lock()
+        atexit.register(self._conn.close)
         self.init_database()
         
+        # ETag cache lives in its own file: it never lands in exports and its reads and
+        # writes don't queue behind the repository writer
+        self.etag_db_path = "ultra_massive_repos_etags.db"
+        self._etag_conn = sqlite3.connect(self.etag_db_path, isolation_level=None,
+                                          check_same_thread=False)
+        self._etag_lock = threading.Lock()
+        self._etag_stores = 0
+        atexit.register(self._etag_conn.close)
+        self.init_etag_cache()
+        
+        # Multi-row INSERTs: as many rows per statement as the bound-variable limit allows
+        try:
+            max_vars = self._conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+        except AttributeError:  # Python < 3.11
+            max_vars = 999
+        self._rows_per_insert = max(1, min(500, max_vars // REPO_INSERT_WIDTH))
+        self._insert_sql_cache = {}
+        
+        # In-process URL filter so known repos never reach the url key
+        self._url_bloom = self._load_url_filter()
+        
         # Collection settings
-        self.target_repos = 1_000_000  # 1 million target
-        self.max_workers = min(len(github_tokens) * 2, 20) if github_tokens else 1
-        self.batch_size = 100
+        self.target_repos = target_repos  # 1 million by default
+        if max_workers is None:
+            max_workers = min(len(github_tokens) * 2, 20) if github_tokens else 1
+        self.max_workers = max_workers
+        
+        # Single DB writer thread fed by HTTP workers through a bounded queue
+        self._repo_queue = queue.Queue(maxsize=50)
+        self._db_writer = None
+        self.db_commit_rows = 5000
+        self.export_fetch_rows = 5000
+        self.export_workers = 4
+        
+        # Read-only export connections, kept across exports so pragmas and prepared
+        # statements are set up once
+        self._export_pool = queue.LifoQueue()
+        self._export_conns = []
+        atexit.register(self.close_export_connections)
+        
+        # Shared HTTP session, opened lazily so it binds to the running loop
+        self._session = None
+        self._base_headers = {
+            "Accept": "application/vnd.github.v3+json",
+            "User-Agent": "UltraMassiveRepoCollector/2.0"
+        }
         
         # Progress tracking
         self.collected_count = 0
@@ -288,15 +442,56 @@ class UltraMassiveRepoCollector:
             "network_discovery", "trending_based", "recently_updated", "license_based"
         ]
     
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the collector-wide HTTP session, opening it on first use"""
+        if self._session is None or self._session.closed:
+            # Every request goes to api.github.com, so the per-host cap is the real limit
+            per_host = max(50, self.max_workers * 2)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=per_host,
+                    limit_per_host=per_host,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=75
+                ),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+    
+    async def aclose(self):
+        """Stop the DB writer and close the shared HTTP session"""
+        await self._stop_db_writer()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def __aenter__(self):
+        self._get_session()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+    
     def init_database(self):
         """Initialize SQLite database for persistence"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
         
+        # WAL + synchronous=NORMAL: a crash can drop the last few commits, but every
+        # row is re-fetchable from GitHub, so we trade that for far cheaper commits
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-131072")  # 128 MB
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA wal_autocheckpoint=10000")
+        cursor.execute("PRAGMA threads=4")  # helper threads for sorts and index builds
+        
+        # Keyed directly on url: one B-tree per row instead of rowid table + UNIQUE index.
+        # Databases created before this keep their rowid layout; both work unchanged.
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS repositories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT UNIQUE NOT NULL,
+                url TEXT PRIMARY KEY NOT NULL,
                 name TEXT,
                 owner TEXT,
                 stars INTEGER,
@@ -307,11 +502,12 @@ class UltraMassiveRepoCollector:
                 updated_at TEXT,
                 size INTEGER,
                 collected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+            ) WITHOUT ROWID
         ''')
         
+        # url is already uniquely indexed; this duplicate only slowed every insert
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_url ON repositories(url);
+            DROP INDEX IF EXISTS idx_url;
         ''')
         
         cursor.execute('''
@@ -322,128 +518,293 @@ class UltraMassiveRepoCollector:
             CREATE INDEX IF NOT EXISTS idx_stars ON repositories(stars);
         ''')
         
-        conn.commit()
-        conn.close()
+        # The ETag cache moved to its own database file
+        cursor.execute('''
+            DROP TABLE IF EXISTS etags
+        ''')
+    
+    def init_etag_cache(self):
+        """Initialize the conditional-request cache: 304 replies are free against the rate limit"""
+        cursor = self._etag_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=OFF")  # losing the cache only costs a refetch
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS etags (
+                query TEXT,
+                page INTEGER,
+                etag TEXT,
+                body BLOB,
+                fetched_at REAL,
+                PRIMARY KEY (query, page)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_etags_fetched_at ON etags(fetched_at);
+        ''')
+        self._prune_etag_cache()
     
     def save_repositories_batch(self, repos_data: List[Dict]):
         """Save a batch of repositories to database"""
         if not repos_data:
             return
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        insert_data = []
+        # In-batch dedup stays local; the shared filter only learns URLs once they commit
+        fresh = []
+        seen = set()
         for repo in repos_data:
-            insert_data.append((
-                repo.get('html_url', ''),
-                repo.get('name', ''),
-                repo.get('owner', {}).get('login', ''),
-                repo.get('stargazers_count', 0),
-                repo.get('forks_count', 0),
-                repo.get('language', ''),
-                json.dumps(repo.get('topics', [])),
-                repo.get('created_at', ''),
-                repo.get('updated_at', ''),
-                repo.get('size', 0)
-            ))
-        
-        cursor.executemany('''
-            INSERT OR IGNORE INTO repositories 
-            (url, name, owner, stars, forks, language, topics, created_at, updated_at, size)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', insert_data)
-        
-        conn.commit()
-        conn.close()
-        
-        self.collected_count += cursor.rowcount
+            url = repo.get('html_url', '')
+            if url in seen or url in self._url_bloom:
+                self.duplicate_count += 1
+                continue
+            seen.add(url)
+            fresh.append(repo)
+        
+        if not fresh:
+            return
+        
+        # Insert in url order so writes to the url key walk the B-tree sequentially
+        fresh.sort(key=lambda repo: repo.get('html_url', ''))
+        
+        # Column-wise (one list per field) instead of a tuple per row
+        columns = [
+            [repo.get('html_url', '') for repo in fresh],
+            [repo.get('name', '') for repo in fresh],
+            [(repo.get('owner') or {}).get('login', '') for repo in fresh],
+            [repo.get('stargazers_count', 0) for repo in fresh],
+            [repo.get('forks_count', 0) for repo in fresh],
+            [repo.get('language', '') for repo in fresh],
+            [orjson.dumps(repo.get('topics', [])).decode() for repo in fresh],
+            [repo.get('created_at', '') for repo in fresh],
+            [repo.get('updated_at', '') for repo in fresh],
+            [repo.get('size', 0) for repo in fresh],
+        ]
+        
+        rows = self._rows_per_insert
+        full_sql = self._multi_insert_sql(rows)
+        
+        with self._db_lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                for i in range(0, len(fresh), rows):
+                    n = min(rows, len(fresh) - i)
+                    sql = full_sql if n == rows else self._multi_insert_sql(n)
+                    # Interleave the column slices straight into the flat parameter list
+                    params = [None] * (n * REPO_INSERT_WIDTH)
+                    for col_idx, column in enumerate(columns):
+                        params[col_idx::REPO_INSERT_WIDTH] = column[i:i + n]
+                    cursor.execute(sql, params)
+                inserted = self._conn.total_changes - before
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        
+        # Only after COMMIT: a rolled-back batch must not look like duplicates on retry
+        for url in columns[0]:
+            self._url_bloom.add(url)
+        self.collected_count += inserted
+    
+    def _load_url_filter(self):
+        """Build the URL membership filter, seeded from repositories already stored"""
+        if BLOOM_AVAILABLE:
+            url_filter = ScalableBloomFilter(initial_capacity=2_000_000, error_rate=0.001)
+        else:
+            url_filter = set()
+        
+        with self._db_lock:
+            for (url,) in self._conn.execute('SELECT url FROM repositories'):
+                url_filter.add(url)
+        return url_filter
+    
+    def _multi_insert_sql(self, n_rows: int) -> str:
+        """Build (and cache) an INSERT statement carrying n_rows value tuples"""
+        sql = self._insert_sql_cache.get(n_rows)
+        if sql is None:
+            sql = _INSERT_SQL + ",".join([_INSERT_ROW] * n_rows)
+            self._insert_sql_cache[n_rows] = sql
+        return sql
     
     def get_collected_count(self) -> int:
         """Get current count of collected repositories"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM repositories')
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        with self._db_lock:
+            return self._conn.execute('SELECT COUNT(*) FROM repositories').fetchone()[0]
     
-    def search_with_single_query(self, query: str, max_pages: int = 10) -> List[Dict]:
-        """Search repositories with a single query, handling pagination"""
-        all_repos = []
+    async def _fetch_one_page(self, query: str, page: int) -> Optional[Dict]:
+        """Fetch one page of search results, returning the decoded body or None"""
+        # The limiter sleeps under a threading lock, so keep it off the event loop
+        token, token_idx = await asyncio.to_thread(self.rate_limiter.wait_and_get_token)
+        if not token:
+            print("❌ No tokens available")
+            return None
         
-        for page in range(1, max_pages + 1):
-            token, token_idx = self.rate_limiter.wait_and_get_token()
-            if not token:
-                print("❌ No tokens available")
-                break
+        headers = dict(self._base_headers)
+        headers["Authorization"] = f"token {token}"
+        
+        cached = await asyncio.to_thread(self._get_cached_page, query, page)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        
+        params = {
+            "q": query,
+            "sort": "stars",
+            "order": "desc", 
+            "per_page": SEARCH_PER_PAGE,
+            "page": page
+        }
+        
+        async with self._get_session().get(GITHUB_SEARCH_URL, params=params, headers=headers) as response:
+            self.rate_limiter.update_token_state(token_idx, response)
             
-            headers = {
-                "Authorization": f"token {token}",
-                "Accept": "application/vnd.github.v3+json",
-                "User-Agent": "UltraMassiveRepoCollector/2.0"
-            }
+            if response.status == 200:
+                data = orjson.loads(await response.read())
+                etag = response.headers.get('ETag')
+                if etag:
+                    await asyncio.to_thread(self._store_cached_page, query, page, etag, data)
+                return data
             
-            params = {
-                "q": query,
-                "sort": "stars",
-                "order": "desc", 
-                "per_page": 100,
-                "page": page
-            }
+            if response.status == 304 and cached:
+                return orjson.loads(cached[1])
             
-            try:
-                response = requests.get(
-                    "https://api.github.com/search/repositories",
-                    params=params,
-                    headers=headers,
-                    timeout=30
-                )
-                
-                self.rate_limiter.update_token_state(token_idx, response)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    repos = data.get("items", [])
-                    
-                    if not repos:  # No more results
-                        break
-                    
-                    all_repos.extend(repos)
-                    
-                    # Check if we've hit the search limit (1000 results max)
-                    if data.get("total_count", 0) > 1000 and page * 100 >= 1000:
-                        break
-                
-                elif response.status_code == 403:
-                    print(f"🚫 Rate limited on token {token_idx}")
-                    self.rate_limiter.mark_token_failure(token_idx)
-                    time.sleep(1)
-                    continue
-                
-                elif response.status_code == 422:
-                    print(f"❌ Invalid query: {query}")
-                    break
-                
-                else:
-                    print(f"❌ HTTP {response.status_code} for query: {query}")
-                    self.error_count += 1
-                    break
-                    
-            except Exception as e:
-                print(f"❌ Error searching '{query}': {e}")
+            if response.status == 403:
+                print(f"🚫 Rate limited on token {token_idx}")
+                self.rate_limiter.mark_token_failure(token_idx)
+                await asyncio.sleep(1)
+            elif response.status == 422:
+                print(f"❌ Invalid query: {query}")
+            else:
+                print(f"❌ HTTP {response.status} for query: {query}")
                 self.error_count += 1
-                break
+            return None
+    
+    def _get_cached_page(self, query: str, page: int) -> Optional[tuple]:
+        """Return the cached (etag, body) for a search page, if any"""
+        with self._etag_lock:
+            return self._etag_conn.execute(
+                'SELECT etag, body FROM etags WHERE query = ? AND page = ? AND fetched_at > ?',
+                (query, page, time.time() - ETAG_CACHE_TTL)
+            ).fetchone()
+    
+    def _store_cached_page(self, query: str, page: int, etag: str, data: Dict):
+        """Remember a search page's ETag and the repo fields we use, for conditional re-fetches"""
+        items = []
+        for repo in data.get("items", []):
+            item = {key: repo[key] for key in ETAG_CACHE_ITEM_FIELDS if key in repo}
+            item["owner"] = {"login": (repo.get("owner") or {}).get("login", "")}
+            items.append(item)
+        body = orjson.dumps({"total_count": data.get("total_count", 0), "items": items})
+        
+        with self._etag_lock:
+            self._etag_conn.execute(
+                'INSERT OR REPLACE INTO etags (query, page, etag, body, fetched_at) VALUES (?, ?, ?, ?, ?)',
+                (query, page, etag, body, time.time())
+            )
+            self._etag_stores += 1
+            if self._etag_stores % ETAG_CACHE_PRUNE_EVERY == 0:
+                self._prune_etag_cache()
+    
+    def _prune_etag_cache(self):
+        """Drop expired cache rows, then the oldest ones past ETAG_CACHE_MAX_ROWS"""
+        self._etag_conn.execute('DELETE FROM etags WHERE fetched_at <= ?',
+                                (time.time() - ETAG_CACHE_TTL,))
+        self._etag_conn.execute(
+            'DELETE FROM etags WHERE fetched_at <= (SELECT fetched_at FROM etags '
+            'ORDER BY fetched_at DESC LIMIT 1 OFFSET ?)', (ETAG_CACHE_MAX_ROWS,)
+        )
+    
+    async def search_with_single_query(self, query: str, max_pages: int = SEARCH_MAX_PAGES) -> List[Dict]:
+        """Search repositories with a single query, handling pagination"""
+        try:
+            first = await self._fetch_one_page(query, 1)
+        except Exception as e:
+            print(f"❌ Error searching '{query}': {e}")
+            self.error_count += 1
+            return []
+        
+        if not first:
+            return []
+        
+        all_repos = list(first.get("items", []))
+        
+        # A short first page means there is nothing more, whatever total_count claims
+        if len(all_repos) < SEARCH_PER_PAGE:
+            return all_repos
+        
+        # Otherwise page 1 tells us how many pages exist
+        total = min(first.get("total_count", 0), SEARCH_RESULT_CAP)
+        n_pages = min(max_pages, (total + SEARCH_PER_PAGE - 1) // SEARCH_PER_PAGE)
+        if n_pages <= 1:
+            return all_repos
+        
+        pages = await asyncio.gather(
+            *(self._fetch_one_page(query, page) for page in range(2, n_pages + 1)),
+            return_exceptions=True
+        )
+        for data in pages:
+            if isinstance(data, Exception):
+                print(f"❌ Error searching '{query}': {data}")
+                self.error_count += 1
+            elif data:
+                all_repos.extend(data.get("items", []))
         
         return all_repos
     
-    def generate_ultra_comprehensive_queries(self) -> List[str]:
-        """Generate thousands of search queries for maximum coverage"""
-        queries = []
+    async def _search_and_queue(self, query: str) -> int:
+        """Run a single query search and hand its repos to the DB writer"""
+        repos = await self.search_with_single_query(query)
+        if repos:
+            # put() blocks when the writer falls behind, so keep it off the event loop
+            await asyncio.to_thread(self._repo_queue.put, repos)
+        return len(repos)
+    
+    def _start_db_writer(self):
+        """Start the thread that owns all repository inserts"""
+        if self._db_writer is None:
+            self._db_writer = threading.Thread(target=self._db_writer_loop, daemon=True)
+            self._db_writer.start()
+    
+    async def _stop_db_writer(self):
+        """Flush queued repositories and wait for the writer thread to exit"""
+        if self._db_writer is not None:
+            await asyncio.to_thread(self._repo_queue.put, None)
+            await asyncio.to_thread(self._db_writer.join)
+            self._db_writer = None
+    
+    def _db_writer_loop(self):
+        """Drain the repo queue, committing every db_commit_rows rows or when idle"""
+        pending = []
+        while True:
+            try:
+                repos = self._repo_queue.get(timeout=1.0)
+            except queue.Empty:
+                repos = []
+            
+            if repos is None:
+                break
+            pending.extend(repos)
+            
+            if pending and (len(pending) >= self.db_commit_rows or not repos):
+                self._write_pending(pending)
+                pending = []
         
+        if pending:
+            self._write_pending(pending)
+    
+    def _write_pending(self, pending: List[Dict]):
+        """Save buffered repositories, logging rather than killing the writer on failure"""
+        try:
+            self.save_repositories_batch(pending)
+        except Exception as e:
+            print(f"❌ Failed to save {len(pending)} repositories: {e}")
+            self.error_count += 1
+    
+    def _language_queries(self) -> Iterator[str]:
+        """Language-based search queries"""
         # 1. Language-based searches (detailed)
         for lang in self.programming_languages:
-            queries.extend([
+            yield from [
                 f"language:{lang} stars:>0",
                 f"language:{lang} stars:>1",
                 f"language:{lang} stars:>5",
@@ -465,11 +826,13 @@ class UltraMassiveRepoCollector:
                 f"language:{lang} created:>2018-01-01",
                 f"language:{lang} created:>2020-01-01",
                 f"language:{lang} created:>2022-01-01"
-            ])
-        
+            ]
+    
+    def _topic_queries(self) -> Iterator[str]:
+        """Topic-based search queries"""
         # 2. Topic-based searches (comprehensive)
         for topic in self.comprehensive_topics:
-            queries.extend([
+            yield from [
                 f"topic:{topic}",
                 f"topic:{topic} stars:>0",
                 f"topic:{topic} stars:>5",
@@ -483,8 +846,10 @@ class UltraMassiveRepoCollector:
                 f"topic:{topic} language:Rust",
                 f"topic:{topic} language:C++",
                 f"topic:{topic} language:C#"
-            ])
-        
+            ]
+    
+    def _organization_queries(self) -> Iterator[str]:
+        """Organization and user search queries"""
         # 3. Organization searches (massive)
         organizations = [
             # Tech giants
@@ -514,7 +879,7 @@ class UltraMassiveRepoCollector:
         ]
         
         for org in organizations:
-            queries.extend([
+            yield from [
                 f"user:{org}",
                 f"user:{org} stars:>0",
                 f"user:{org} stars:>10",
@@ -526,18 +891,22 @@ class UltraMassiveRepoCollector:
                 f"user:{org} language:C++",
                 f"org:{org}",
                 f"org:{org} stars:>0"
-            ])
-        
+            ]
+    
+    def _time_queries(self) -> Iterator[str]:
+        """Creation/push year search queries"""
         # 4. Time-based searches
         years = list(range(2008, 2025))  # GitHub was founded in 2008
         for year in years:
-            queries.extend([
+            yield from [
                 f"created:{year}-01-01..{year}-12-31 stars:>10",
                 f"created:{year}-01-01..{year}-12-31 language:Python",
                 f"created:{year}-01-01..{year}-12-31 language:JavaScript",
                 f"pushed:{year}-01-01..{year}-12-31 stars:>50"
-            ])
-        
+            ]
+    
+    def _size_queries(self) -> Iterator[str]:
+        """Repository size search queries"""
         # 5. Size-based searches
         size_ranges = [
             "0..1000", "1000..5000", "5000..10000", "10000..50000", 
@@ -545,31 +914,37 @@ class UltraMassiveRepoCollector:
         ]
         for size in size_ranges:
             for lang in self.programming_languages[:20]:  # Top 20 languages
-                queries.append(f"size:{size} language:{lang} stars:>1")
-        
+                yield f"size:{size} language:{lang} stars:>1"
+    
+    def _license_queries(self) -> Iterator[str]:
+        """License search queries"""
         # 6. License-based searches
         licenses = [
             "mit", "apache-2.0", "gpl-3.0", "bsd-3-clause", "unlicense",
             "lgpl-3.0", "mpl-2.0", "cc0-1.0", "epl-2.0", "artistic-2.0"
         ]
         for license in licenses:
-            queries.extend([
+            yield from [
                 f"license:{license} stars:>10",
                 f"license:{license} language:Python",
                 f"license:{license} language:JavaScript"
-            ])
-        
+            ]
+    
+    def _recent_queries(self) -> Iterator[str]:
+        """Recently pushed/updated search queries"""
         # 7. Trending and recently updated
         recent_dates = [
             "2024-01-01", "2023-06-01", "2023-01-01", "2022-01-01"
         ]
         for date in recent_dates:
-            queries.extend([
+            yield from [
                 f"pushed:>{date} stars:>0",
                 f"pushed:>{date} stars:>10",
                 f"updated:>{date} stars:>5"
-            ])
-        
+            ]
+    
+    def _keyword_queries(self) -> Iterator[str]:
+        """Name/description keyword search queries"""
         # 8. Keyword searches in name/description
         keywords = [
             "framework", "library", "tool", "cli", "api", "app", "game",
@@ -577,48 +952,72 @@ class UltraMassiveRepoCollector:
             "template", "boilerplate", "starter", "example", "demo", "tutorial"
         ]
         for keyword in keywords:
-            queries.extend([
+            yield from [
                 f"in:name {keyword} stars:>5",
                 f"in:description {keyword} stars:>10",
                 f"{keyword} language:Python",
                 f"{keyword} language:JavaScript"
-            ])
-        
+            ]
+    
+    def _archive_queries(self) -> Iterator[str]:
+        """Archive, mirror and fork search queries"""
         # 9. Archive and mirror searches
-        queries.extend([
+        yield from [
             "archived:false stars:>100",
             "archived:true stars:>500",  # Popular archived projects
             "mirror:false stars:>50",
             "fork:false stars:>20",
             "fork:true stars:>100"  # Popular forks
-        ])
-        
+        ]
+    
+    def _language_pair_queries(self) -> Iterator[str]:
+        """Language pair search queries"""
         # 10. Language combination searches
         lang_pairs = [
             ("Python", "JavaScript"), ("Java", "Kotlin"), ("C", "C++"),
             ("TypeScript", "JavaScript"), ("Go", "Rust"), ("Swift", "Objective-C")
         ]
         for lang1, lang2 in lang_pairs:
-            queries.extend([
+            yield from [
                 f"language:{lang1} OR language:{lang2} stars:>50",
                 f"language:{lang1} language:{lang2} stars:>10"  # Multi-language repos
-            ])
-        
-        # Remove duplicates and shuffle for better distribution
-        queries = list(set(queries))
-        random.shuffle(queries)
-        
-        print(f"Generated {len(queries):,} comprehensive search queries")
-        return queries
+            ]
+
     
-    def collect_ultra_massive_repos(self) -> int:
+    def _iter_queries(self) -> Iterator[str]:
+        """Yield thousands of search queries, interleaving every strategy round-robin"""
+        sources = [
+            self._language_queries(), self._topic_queries(), self._organization_queries(),
+            self._time_queries(), self._size_queries(), self._license_queries(),
+            self._recent_queries(), self._keyword_queries(), self._archive_queries(),
+            self._language_pair_queries()
+        ]
+        # Only the handful of sources is shuffled, never the queries themselves
+        random.shuffle(sources)
+        while sources:
+            for source in list(sources):
+                query = next(source, None)
+                if query is None:
+                    sources.remove(source)
+                else:
+                    yield query
+    
+    def _iter_unique_queries(self) -> Iterator[str]:
+        """Yield each distinct query once"""
+        seen = set()
+        for query in self._iter_queries():
+            if query not in seen:
+                seen.add(query)
+                yield query
+    
+    async def collect_ultra_massive_repos(self) -> int:
         """Main collection function for 1M+ repositories"""
         print(f"🚀 Starting ULTRA MASSIVE repository collection")
         print(f"🎯 Target: {self.target_repos:,} repositories")
         print(f"🔧 Max workers: {self.max_workers}")
         print(f"💾 Database: {self.db_path}")
         
-        # Check existing progress
+        # Check existing progress; afterwards the in-memory insert counter tracks growth
         existing_count = self.get_collected_count()
         print(f"📊 Already collected: {existing_count:,} repositories")
         
@@ -626,64 +1025,56 @@ class UltraMassiveRepoCollector:
             print(f"✅ Target already reached!")
             return existing_count
         
-        # Generate comprehensive search queries
-        all_queries = self.generate_ultra_comprehensive_queries()
-        total_queries = len(all_queries)
+        # Queries are generated lazily and pulled as worker slots free up
+        query_iter = self._iter_unique_queries()
         
-        print(f"📡 Generated {total_queries:,} search queries")
         print(f"🔍 Starting parallel search execution...")
         
-        # Process queries in batches with multiple workers
-        batch_size = self.batch_size
+        self._start_db_writer()
+        
+        # Keep max_workers queries in flight; each finished query is replaced at once,
+        # so one slow query never holds up the others
+        in_flight = {}
         completed_queries = 0
+        target_reached = False
         
-        for i in range(0, len(all_queries), batch_size):
-            batch_queries = all_queries[i:i + batch_size]
-            batch_num = i // batch_size + 1
-            total_batches = (len(all_queries) + batch_size - 1) // batch_size
-            
-            print(f"\n📦 Processing batch {batch_num}/{total_batches} ({len(batch_queries)} queries)")
+        def refill():
+            while len(in_flight) < self.max_workers:
+                query = next(query_iter, None)
+                if query is None:
+                    return
+                in_flight[asyncio.create_task(self._search_and_queue(query))] = query
+        
+        refill()
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
             
-            # Execute batch with thread pool
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                future_to_query = {
-                    executor.submit(self.search_with_single_query, query, 10): query
-                    for query in batch_queries
-                }
-                
-                batch_repos = []
-                for future in as_completed(future_to_query):
-                    query = future_to_query[future]
-                    try:
-                        repos = future.result()
-                        batch_repos.extend(repos)
-                        completed_queries += 1
-                        
-                        if completed_queries % 50 == 0:
-                            current_count = self.get_collected_count()
-                            progress = (completed_queries / total_queries) * 100
-                            print(f"📈 Progress: {progress:.1f}% ({completed_queries}/{total_queries} queries) | "
-                                  f"Collected: {current_count:,} repos")
-                        
-                    except Exception as e:
-                        print(f"❌ Query failed '{query}': {e}")
-                        self.error_count += 1
+            for task in done:
+                query = in_flight.pop(task)
+                if task.exception() is not None:
+                    print(f"❌ Query failed '{query}': {task.exception()}")
+                    self.error_count += 1
+                    continue
                 
-                # Save batch to database
-                if batch_repos:
-                    print(f"💾 Saving {len(batch_repos)} repositories from batch {batch_num}")
-                    self.save_repositories_batch(batch_repos)
+                completed_queries += 1
                 
-                # Check if target reached
-                current_count = self.get_collected_count()
-                if current_count >= self.target_repos:
-                    print(f"🎯 TARGET REACHED! Collected {current_count:,} repositories")
-                    break
+                if completed_queries % 50 == 0:
+                    current_count = existing_count + self.collected_count
+                    print(f"📈 Progress: {completed_queries:,} queries done | "
+                          f"Collected: {current_count:,} repos")
+            
+            # Check if target reached; if so, let in-flight queries drain without refilling
+            current_count = existing_count + self.collected_count
+            if not target_reached and current_count >= self.target_repos:
+                print(f"🎯 TARGET REACHED! Collected {current_count:,} repositories")
+                target_reached = True
             
-            # Brief pause between batches to be respectful
-            time.sleep(2)
+            if not target_reached:
+                refill()
+        
+        await self._stop_db_writer()
         
-        final_count = self.get_collected_count()
+        final_count = existing_count + self.collected_count
         print(f"\n✅ ULTRA MASSIVE COLLECTION COMPLETE!")
         print(f"📊 Final count: {final_count:,} repositories")
         print(f"❌ Errors encountered: {self.error_count}")
@@ -691,51 +1082,285 @@ class UltraMassiveRepoCollector:
         
         return final_count
     
-    def export_repositories(self, output_file: str = "ultra_massive_repos.json"):
-        """Export collected repositories to JSON"""
-        print(f"📤 Exporting repositories to {output_file}...")
+    @contextmanager
+    def _export_connection(self):
+        """Borrow a cached read-only export connection, opening one if none is idle"""
+        try:
+            conn = self._export_pool.get_nowait()
+        except queue.Empty:
+            conn = self._open_export_connection()
+            self._export_conns.append(conn)
+        try:
+            yield conn
+        finally:
+            self._export_pool.put(conn)
+    
+    def close_export_connections(self):
+        """Interrupt any running export scans and close the cached export connections"""
+        for conn in self._export_conns:
+            conn.interrupt()
+            conn.close()
+        self._export_conns.clear()
+        self._export_pool = queue.LifoQueue()
+    
+    def _open_export_connection(self) -> sqlite3.Connection:
+        """Open a read-only connection tuned for one long sequential scan"""
+        # A separate reader in WAL mode never blocks (or waits on) the collector's writer
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               detect_types=sqlite3.PARSE_COLNAMES)
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        conn.execute("PRAGMA cache_size=-262144")  # 256 MB
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def _export_shards(self, conn: sqlite3.Connection) -> List[tuple]:
+        """Split the stars-ordered export into contiguous, non-overlapping star ranges"""
+        total = conn.execute('SELECT COUNT(*) FROM repositories').fetchone()[0]
+        n_shards = max(1, min(self.export_workers * 4, total // self.export_fetch_rows))
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Boundaries are star values at evenly spaced offsets; repeats collapse shards
+        bounds = []
+        for k in range(1, n_shards):
+            row = conn.execute(
+                'SELECT stars FROM repositories WHERE stars IS NOT NULL '
+                'ORDER BY stars DESC LIMIT 1 OFFSET ?', (k * total // n_shards,)
+            ).fetchone()
+            if row and (not bounds or row[0] < bounds[-1]):
+                bounds.append(row[0])
         
-        cursor.execute('''
-            SELECT url, name, owner, stars, forks, language, topics, created_at, updated_at, size
-            FROM repositories 
-            ORDER BY stars DESC
-        ''')
+        shards = []
+        upper = None
+        for bound in bounds:
+            if upper is None:
+                shards.append(("stars >= ?", (bound,)))
+            else:
+                shards.append(("stars < ? AND stars >= ?", (upper, bound)))
+            upper = bound
+        if upper is None:
+            shards.append(("1", ()))
+        else:
+            shards.append(("stars < ? OR stars IS NULL", (upper,)))
+        return shards
+    
+    def _encode_export_shard(self, where: str, params: tuple, out_q: queue.Queue,
+                             stop: threading.Event, dump_option, indent_rows: bool, sep: bytes):
+        """Encode one star range into byte chunks on its own read-only connection"""
+        try:
+            with self._export_connection() as conn:
+                topics_sql = _DECODED_TOPICS if indent_rows else _RAW_TOPICS
+                cursor = conn.execute(_EXPORT_SQL.format(topics=topics_sql, where=where), params)
+                # idx_stars is walked backwards for the ORDER BY, so no temp sort is built;
+                # rows are pulled in bounded fetchmany() chunks
+                cursor.arraysize = self.export_fetch_rows
+                
+                # One scratch dict reused for every row; orjson copies values out on each call
+                repo = dict.fromkeys(EXPORT_FIELDS)
+                
+                while not stop.is_set():
+                    rows = cursor.fetchmany()
+                    if not rows:
+                        break
+                    encoded = []
+                    if indent_rows:
+                        # Pretty output re-indents topics, so only here do they arrive decoded
+                        for row in rows:
+                            (repo["url"], repo["name"], repo["owner"], repo["stars"], repo["forks"],
+                             repo["language"], repo["topics"], repo["created_at"], repo["updated_at"],
+                             repo["size"]) = row
+                            encoded.append(orjson.dumps(repo, option=dump_option).replace(b'\n', b'\n  '))
+                    else:
+                        repo["topics"] = None
+                        for row in rows:
+                            (repo["url"], repo["name"], repo["owner"], repo["stars"], repo["forks"],
+                             repo["language"], topics, repo["created_at"], repo["updated_at"],
+                             repo["size"]) = row
+                            # A bare "topics":null can only be the key itself (quotes inside
+                            # string values are always escaped), so splice the stored JSON there
+                            data = orjson.dumps(repo, option=dump_option)
+                            encoded.append(data.replace(b'"topics":null', b'"topics":' + (topics or b'[]'), 1))
+                    out_q.put((len(encoded), sep.join(encoded)))
+        except Exception as e:
+            out_q.put(e)
+        finally:
+            out_q.put(None)
+    
+    def _export_parquet(self, output_file: str) -> int:
+        """Write repositories as a zstd-compressed Parquet file, one column per field"""
+        if not PYARROW_AVAILABLE:
+            print("❌ Parquet export needs pyarrow: pip install pyarrow")
+            return 0
         
-        repos = []
-        for row in cursor.fetchall():
-            repos.append({
-                "url": row[0],
-                "name": row[1],
-                "owner": row[2],
-                "stars": row[3],
-                "forks": row[4],
-                "language": row[5],
-                "topics": json.loads(row[6]) if row[6] else [],
-                "created_at": row[7],
-                "updated_at": row[8],
-                "size": row[9]
-            })
-        
-        conn.close()
-        
-        with open(output_file, 'w') as f:
-            json.dump(repos, f, indent=2)
-        
-        print(f"✅ Exported {len(repos):,} repositories to {output_file}")
-        return len(repos)
+        schema = pa.schema([
+            ("url", pa.string()),
+            ("name", pa.string()),
+            ("owner", pa.dictionary(pa.int32(), pa.string())),
+            ("stars", pa.int64()),
+            ("forks", pa.int64()),
+            ("language", pa.dictionary(pa.int32(), pa.string())),
+            ("topics", pa.list_(pa.string())),
+            ("created_at", pa.timestamp("s")),
+            ("updated_at", pa.timestamp("s")),
+            ("size", pa.int64()),
+        ])
+        
+        def timestamps(values):
+            # GitHub sends ISO-8601 UTC; blanks from older rows become nulls
+            return pc.strptime(pa.array(values, type=pa.string()), format="%Y-%m-%dT%H:%M:%SZ",
+                               unit="s", error_is_null=True)
+        
+        count = 0
+        with self._export_connection() as conn, \
+                pq.ParquetWriter(output_file, schema, compression="zstd") as writer:
+            cursor = conn.execute(_EXPORT_SQL.format(topics=_DECODED_TOPICS, where="1"))
+            cursor.arraysize = 50_000
+            
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                batch = pa.RecordBatch.from_arrays([
+                    pa.array(columns[0], type=pa.string()),
+                    pa.array(columns[1], type=pa.string()),
+                    pa.array(columns[2], type=pa.string()).dictionary_encode(),
+                    pa.array(columns[3], type=pa.int64()),
+                    pa.array(columns[4], type=pa.int64()),
+                    pa.array(columns[5], type=pa.string()).dictionary_encode(),
+                    pa.array(columns[6], type=pa.list_(pa.string())),
+                    timestamps(columns[7]),
+                    timestamps(columns[8]),
+                    pa.array(columns[9], type=pa.int64()),
+                ], schema=schema)
+                writer.write_batch(batch)
+                count += len(rows)
+        
+        print(f"✅ Exported {count:,} repositories to {output_file}")
+        return count
+    
+    def _export_sql_dump(self, output_file: str) -> int:
+        """Write the whole database as a portable SQL text dump"""
+        with self._export_connection() as conn, self._open_export_file(output_file) as f:
+            # Encoded in blocks of statements: the zstd writer has no writelines, and one
+            # write per statement would cross into the compressor millions of times
+            lines = conn.iterdump()
+            while block := list(islice(lines, 10_000)):
+                f.write(('\n'.join(block) + '\n').encode())
+            count = conn.execute('SELECT COUNT(*) FROM repositories').fetchone()[0]
+        
+        print(f"✅ Dumped {count:,} repositories to {output_file}")
+        return count
+    
+    def _export_sqlite_backup(self, output_file: str) -> int:
+        """Copy the database page by page with SQLite's online backup API"""
+        with self._export_connection() as conn, \
+                closing(sqlite3.connect(output_file)) as dst:
+            conn.backup(dst)
+            count = conn.execute('SELECT COUNT(*) FROM repositories').fetchone()[0]
+        
+        print(f"✅ Backed up {count:,} repositories to {output_file}")
+        return count
+    
+    def _open_export_file(self, output_file: str):
+        """Open the export for binary writing, zstd-compressing it when the name ends in .zst"""
+        raw = open(output_file, 'wb', buffering=1 << 20)
+        if output_file.endswith(".zst"):
+            # Level 3 on all cores keeps compression ahead of the encoders; closing the
+            # stream writer finishes the frame and closes the file
+            return zstd.ZstdCompressor(level=3, threads=-1).stream_writer(raw)
+        return raw
+    
+    def export_repositories(self, output_file: str = "ultra_massive_repos.json",
+                            fmt: str = "json", pretty: bool = False):
+        """Export repositories as a JSON array, NDJSON, Parquet, a SQL dump or a SQLite copy"""
+        print(f"📤 Exporting repositories to {output_file} ({fmt})...")
+        
+        if output_file.endswith(".zst"):
+            # Both are binary files written in place; Parquet already compresses with zstd
+            if fmt in ("parquet", "sqlite"):
+                print(f"❌ {fmt} exports can't be zstd-compressed: drop the .zst suffix")
+                return 0
+            if not ZSTD_AVAILABLE:
+                print("❌ Compressed export needs zstandard: pip install zstandard")
+                return 0
+        
+        if fmt == "parquet":
+            return self._export_parquet(output_file)
+        if fmt == "sql":
+            return self._export_sql_dump(output_file)
+        if fmt == "sqlite":
+            return self._export_sqlite_backup(output_file)
+        
+        # Indentation only when asked for
+        if fmt == "ndjson":
+            start, first_sep, sep, end, empty = b'', b'', b'', b'', b''
+            dump_option = orjson.OPT_APPEND_NEWLINE
+        elif pretty:
+            start, first_sep, sep, end, empty = b'[', b'\n  ', b',\n  ', b'\n]', b']'
+            dump_option = orjson.OPT_INDENT_2
+        else:
+            start, first_sep, sep, end, empty = b'[', b'', b',', b']', b']'
+            dump_option = None
+        indent_rows = dump_option == orjson.OPT_INDENT_2
+        
+        with self._export_connection() as conn:
+            shards = self._export_shards(conn)
+        
+        # Encoder threads each read one star range over their own WAL reader; this thread
+        # is the single writer and drains the shard queues in order, so output stays sorted
+        queues = [queue.Queue(maxsize=8) for _ in shards]
+        stop = threading.Event()
+        count = 0
+        with ThreadPoolExecutor(max_workers=self.export_workers) as pool, \
+                self._open_export_file(output_file) as f:
+            for (where, params), out_q in zip(shards, queues):
+                pool.submit(self._encode_export_shard, where, params, out_q,
+                            stop, dump_option, indent_rows, sep)
+            
+            current = 0
+            try:
+                f.write(start)
+                for current, out_q in enumerate(queues):
+                    while True:
+                        item = out_q.get()
+                        if item is None:
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        n_rows, data = item
+                        f.write(sep if count else first_sep)
+                        f.write(data)
+                        count += n_rows
+                f.write(end if count else empty)
+            except BaseException:
+                # Unblock encoders stuck on full queues so the pool can shut down
+                stop.set()
+                for out_q in queues[current:]:
+                    while out_q.get() is not None:
+                        pass
+                raise
+        
+        print(f"✅ Exported {count:,} repositories to {output_file}")
+        return count
 
 def main():
     """Ultra massive repository collection"""
-    import argparse
-    
     parser = argparse.ArgumentParser(description="Ultra Massive Repository Collector (1M+ repos)")
     parser.add_argument("--tokens", nargs='+', help="GitHub API tokens (space separated)")
     parser.add_argument("--target", type=int, default=1_000_000, help="Target number of repos (default: 1M)")
     parser.add_argument("--workers", type=int, default=20, help="Max parallel workers")
-    parser.add_argument("--export", type=str, help="Export to JSON file")
+    parser.add_argument("--export", type=str, help="Export to JSON file (add .zst to compress JSON, NDJSON or SQL with zstd)")
+    parser.add_argument("--export-parquet", type=str,
+                        help="Also export to a columnar Parquet file (requires pyarrow)")
+    parser.add_argument("--format", choices=["json", "ndjson", "parquet", "sql", "sqlite"], default=None,
+                        help="Export format: 'json' writes one JSON array; 'ndjson' writes one repo "
+                             "object per line so consumers can stream it; 'sql' and 'sqlite' write "
+                             "a full SQL dump or database backup (default: picked from the file "
+                             "extension, json otherwise)")
+    parser.add_argument("--pretty", action="store_true",
+                        help="Indent the JSON export for reading by eye (only honoured below "
+                             f"{PRETTY_EXPORT_MAX_ROWS:,} repos; larger exports stay compact)")
     parser.add_argument("--resume", action="store_true", help="Resume from existing database")
     
     args = parser.parse_args()
@@ -749,20 +1374,33 @@ def main():
     
     print(f"🔑 Using {len(args.tokens)} GitHub tokens")
     
-    collector = UltraMassiveRepoCollector(github_tokens=args.tokens)
-    collector.target_repos = args.target
-    collector.max_workers = args.workers
+    collector = UltraMassiveRepoCollector(
+        github_tokens=args.tokens,
+        target_repos=args.target,
+        max_workers=args.workers
+    )
     
     if args.resume:
         existing = collector.get_collected_count()
         print(f"📂 Resuming from {existing:,} existing repositories")
     
+    async def run_collection():
+        async with collector:
+            return await collector.collect_ultra_massive_repos()
+    
     # Start collection
-    final_count = collector.collect_ultra_massive_repos()
+    final_count = asyncio.run(run_collection())
     
     # Export if requested
     if args.export:
-        collector.export_repositories(args.export)
+        suffix = Path(args.export.removesuffix(".zst")).suffix
+        fmt = args.format or EXPORT_SUFFIX_FORMATS.get(suffix, "json")
+        pretty = args.pretty and collector.get_collected_count() < PRETTY_EXPORT_MAX_ROWS
+        if args.pretty and not pretty:
+            print(f"⚠️  --pretty ignored: more than {PRETTY_EXPORT_MAX_ROWS:,} repos, writing compact JSON")
+        collector.export_repositories(args.export, fmt=fmt, pretty=pretty)
+    if args.export_parquet:
+        collector.export_repositories(args.export_parquet, fmt="parquet")
     
     print(f"\n🎉 MISSION ACCOMPLISHED!")
     print(f"📊 Collected: {final_count:,} repositories")
@@ -11,24 +11,38 @@ Architecture:
 4. Trainer → Query Elasticsearch for high-quality samples
 """
 
+import io
 import os
 import sys
-import json
+import csv
+import shutil
+import subprocess
 import time
 import logging
 import hashlib
+import threading
 import multiprocessing as mp
-from typing import Dict, List, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from pathlib import Path
 import re
 
+import blake3
+import orjson
 import redis
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import ConflictError, Elasticsearch, helpers
+from elasticsearch.serializer import JsonSerializer
 import psycopg2
 from psycopg2 import pool
-import git
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
 
 # Import security scanners
 from security_scanner import SecurityScanner
@@ -41,7 +55,7 @@ from tracing import get_tracer, trace_function
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - [%(process)d] - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - [%(process)d:%(threadName)s] - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
@@ -64,10 +78,28 @@ class PipelineConfig:
     QUEUE_REPOS_NORMAL = "pipeline:repos:normal"
     QUEUE_REPOS_LOW = "pipeline:repos:low"
     QUEUE_DEAD_LETTER = "pipeline:dead_letter"  # Failed jobs
+    QUEUE_METADATA_RETRY = "pipeline:metadata:retry"  # Metadata rows PostgreSQL could not take
     SET_PROCESSED_REPOS = "pipeline:processed:repos"
     SET_PROCESSED_FILES = "pipeline:processed:files"
+    SET_INDEXED_CONTENT = "pipeline:indexed:content"  # Content hashes already in ES
     HASH_REPO_METADATA = "pipeline:meta:repos"
 
+    # Repo queue payload format ("msgpack" or "json")
+    SERIALIZER = os.getenv("SERIALIZER", "msgpack")
+
+    # Redis batching: file jobs are checked and pushed this many per round-trip
+    REDIS_BATCH_SIZE = 1000
+
+    # Code sample stream: file workers append samples and index workers drain them into
+    # Elasticsearch, so ES latency (refreshes, merges) never stalls file processing
+    STREAM_CODE_SAMPLES = "pipeline:stream:samples"
+    STREAM_INDEXER_GROUP = "indexers"
+    STREAM_BATCH_SIZE = 100  # samples per stream write from a file worker
+    STREAM_MAX_BACKLOG = int(os.getenv("STREAM_MAX_BACKLOG", "100000"))  # file workers wait above this
+    STREAM_MAX_DELIVERIES = int(os.getenv("STREAM_MAX_DELIVERIES", "5"))  # then rejected samples go to the DLQ
+    STREAM_CLAIM_IDLE_MS = 5 * 60 * 1000  # entries idle this long belong to a dead consumer
+    STREAM_CLAIM_INTERVAL = 60.0  # seconds between scans for such entries
+
     # Retry configuration
     MAX_RETRIES = 3
     RETRY_DELAY_BASE = 2  # seconds
@@ -77,6 +109,14 @@ class PipelineConfig:
     ES_INDEX_CODE = "codelupe-code"
     ES_INDEX_REPOS = "codelupe-repos"
 
+    # Elasticsearch bulk indexing: each index worker reads a batch from the stream, which
+    # is sent as several size-capped bulk requests in parallel
+    ES_BULK_BATCH_SIZE = int(os.getenv("ES_BULK_BATCH_SIZE", "500"))
+    ES_BULK_CHUNK_SIZE = int(os.getenv("ES_BULK_CHUNK_SIZE", "250"))
+    ES_BULK_MAX_CHUNK_BYTES = 50 * 1024 * 1024  # 50MB per bulk request
+    ES_BULK_THREADS = int(os.getenv("ES_BULK_THREADS", "2"))
+    ES_BULK_FLUSH_INTERVAL = 2.0  # seconds; flush a partial batch this often
+
     # PostgreSQL configuration
     DB_HOST = os.getenv("POSTGRES_HOST", "postgres")
     DB_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
@@ -85,15 +125,20 @@ class PipelineConfig:
     DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "coding_pass")
     DB_POOL_MIN = 2
     DB_POOL_MAX = 10
+    PG_METADATA_ENABLED = os.getenv("PG_METADATA_ENABLED", "true").lower() == "true"
+    PG_CONNECT_TIMEOUT = int(os.getenv("PG_CONNECT_TIMEOUT", "5"))  # seconds
+    PG_RETRY_INTERVAL = 30.0  # seconds to skip PostgreSQL after a failure
 
     # Processing configuration
     REPO_DOWNLOAD_DIR = os.getenv("REPOS_DIR", "/app/repos")
     MAX_FILE_SIZE_KB = 500  # 500KB max file size
     MIN_FILE_SIZE_BYTES = 100  # 100 bytes min
+    CLONE_TIMEOUT = int(os.getenv("CLONE_TIMEOUT", "300"))  # seconds per git step
 
     # Worker configuration
     REPO_WORKERS = int(os.getenv("REPO_WORKERS", "4"))
     FILE_WORKERS = int(os.getenv("FILE_WORKERS", "8"))
+    INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "2"))
 
     # Quality filtering
     MIN_QUALITY_FOR_TRAINING = float(os.getenv("MIN_QUALITY_THRESHOLD", "0.7"))  # Only index high-quality samples
@@ -146,11 +191,25 @@ class RepoJob:
     topics: List[str]
 
     def to_json(self) -> str:
-        return json.dumps(asdict(self))
+        return orjson.dumps(self).decode()
 
     @staticmethod
     def from_json(data: str) -> 'RepoJob':
-        return RepoJob(**json.loads(data))
+        return RepoJob(**orjson.loads(data))
+
+    def to_payload(self, serializer: str = "json") -> Union[str, bytes]:
+        """Serialize for the repo queue using the configured format"""
+        if serializer == "msgpack" and MSGPACK_AVAILABLE:
+            return msgpack.packb(self.__dict__, use_bin_type=True)
+        return self.to_json()
+
+    @staticmethod
+    def from_payload(data: Union[str, bytes]) -> 'RepoJob':
+        """Deserialize a repo queue entry (JSON or msgpack)"""
+        # JSON objects always start with '{'; msgpack maps never do
+        if isinstance(data, bytes) and not data.startswith(b'{'):
+            return RepoJob(**msgpack.unpackb(data, raw=False))
+        return RepoJob.from_json(data)
 
 @dataclass
 class FileJob:
@@ -163,11 +222,11 @@ class FileJob:
     retry_count: int = 0  # Track retries
 
     def to_json(self) -> str:
-        return json.dumps(asdict(self))
+        return orjson.dumps(self).decode()
 
     @staticmethod
     def from_json(data: str) -> 'FileJob':
-        data_dict = json.loads(data)
+        data_dict = orjson.loads(data)
         # Handle backward compatibility
         if 'retry_count' not in data_dict:
             data_dict['retry_count'] = 0
@@ -190,7 +249,8 @@ class CodeSample:
     indexed_at: str
 
     def to_dict(self) -> Dict:
-        return asdict(self)
+        # Every field is a scalar, so a shallow copy is enough (asdict deep-copies)
+        return dict(self.__dict__)
 
 # ============================================================================
 # REDIS QUEUE MANAGER
@@ -210,6 +270,16 @@ class RedisQueueManager:
             socket_connect_timeout=5,
             health_check_interval=30,
         )
+        # Repo queue entries may be msgpack bytes, so read them undecoded
+        self.raw_client = redis.Redis(
+            host=config.REDIS_HOST,
+            port=config.REDIS_PORT,
+            db=config.REDIS_DB,
+            decode_responses=False,
+            socket_keepalive=True,
+            socket_connect_timeout=5,
+            health_check_interval=30,
+        )
         logger.info(f"Connected to Redis at {config.REDIS_HOST}:{config.REDIS_PORT}")
 
     def enqueue_repo(self, job: RepoJob) -> bool:
@@ -220,21 +290,28 @@ class RedisQueueManager:
             return False
 
         # Add to queue
-        self.redis_client.rpush(self.config.QUEUE_REPOS, job.to_json())
+        self.raw_client.rpush(self.config.QUEUE_REPOS, job.to_payload(self.config.SERIALIZER))
         logger.info(f"Enqueued repo: {job.full_name}")
         return True
 
     def dequeue_repo(self, timeout: int = 1) -> Optional[RepoJob]:
         """Get next repository job from queue (blocking)"""
-        result = self.redis_client.blpop(self.config.QUEUE_REPOS, timeout=timeout)
+        result = self.raw_client.blpop(self.config.QUEUE_REPOS, timeout=timeout)
         if result:
             _, data = result
-            return RepoJob.from_json(data)
+            return RepoJob.from_payload(data)
         return None
 
+    @staticmethod
+    def file_key(repo_full_name: str, file_relative_path: str) -> str:
+        """Key of a file in the processed-files set"""
+        # Stays MD5: the input is a short path, and changing the hash would orphan every
+        # key already in the processed-files set and requeue all files
+        return hashlib.md5(f"{repo_full_name}:{file_relative_path}".encode()).hexdigest()
+
     def enqueue_file(self, job: FileJob) -> bool:
         """Add file to processing queue"""
-        file_hash = hashlib.md5(f"{job.repo_full_name}:{job.file_relative_path}".encode()).hexdigest()
+        file_hash = self.file_key(job.repo_full_name, job.file_relative_path)
 
         # Check if already processed
         if self.redis_client.sismember(self.config.SET_PROCESSED_FILES, file_hash):
@@ -244,6 +321,23 @@ class RedisQueueManager:
         self.redis_client.rpush(self.config.QUEUE_FILES, job.to_json())
         return True
 
+    def enqueue_files_batch(self, jobs: List[FileJob]) -> int:
+        """Add files to processing queue, skipping processed ones; returns the number enqueued"""
+        enqueued = 0
+        for start in range(0, len(jobs), self.config.REDIS_BATCH_SIZE):
+            chunk = jobs[start:start + self.config.REDIS_BATCH_SIZE]
+
+            # One SMISMEMBER and one RPUSH per chunk instead of two round-trips per file
+            processed = self.redis_client.smismember(
+                self.config.SET_PROCESSED_FILES,
+                [self.file_key(job.repo_full_name, job.file_relative_path) for job in chunk]
+            )
+            pending = [job.to_json() for job, done in zip(chunk, processed) if not done]
+            if pending:
+                self.redis_client.rpush(self.config.QUEUE_FILES, *pending)
+                enqueued += len(pending)
+        return enqueued
+
     def dequeue_file(self, timeout: int = 1) -> Optional[FileJob]:
         """Get next file job from queue (blocking)"""
         result = self.redis_client.blpop(self.config.QUEUE_FILES, timeout=timeout)
@@ -262,9 +356,26 @@ class RedisQueueManager:
 
     def mark_file_processed(self, repo_full_name: str, file_relative_path: str):
         """Mark file as processed"""
-        file_hash = hashlib.md5(f"{repo_full_name}:{file_relative_path}".encode()).hexdigest()
+        file_hash = self.file_key(repo_full_name, file_relative_path)
         self.redis_client.sadd(self.config.SET_PROCESSED_FILES, file_hash)
 
+    def mark_files_processed(self, files: List[Tuple[str, str]]):
+        """Mark (repo_full_name, file_relative_path) pairs as processed in one SADD"""
+        if files:
+            self.redis_client.sadd(
+                self.config.SET_PROCESSED_FILES,
+                *[self.file_key(repo_full_name, path) for repo_full_name, path in files]
+            )
+
+    def is_content_indexed(self, content_hash: str) -> bool:
+        """Check if a content hash is already in Elasticsearch"""
+        return self.redis_client.sismember(self.config.SET_INDEXED_CONTENT, content_hash)
+
+    def mark_content_indexed(self, content_hashes: List[str]):
+        """Record content hashes once Elasticsearch has accepted them"""
+        if content_hashes:
+            self.redis_client.sadd(self.config.SET_INDEXED_CONTENT, *content_hashes)
+
     def get_queue_lengths(self) -> Dict[str, int]:
         """Get current queue lengths"""
         return {
@@ -274,10 +385,100 @@ class RedisQueueManager:
             'repos_normal': self.redis_client.llen(self.config.QUEUE_REPOS_NORMAL),
             'repos_low': self.redis_client.llen(self.config.QUEUE_REPOS_LOW),
             'dead_letter': self.redis_client.llen(self.config.QUEUE_DEAD_LETTER),
+            'metadata_retry': self.redis_client.llen(self.config.QUEUE_METADATA_RETRY),
             'processed_repos': self.redis_client.scard(self.config.SET_PROCESSED_REPOS),
             'processed_files': self.redis_client.scard(self.config.SET_PROCESSED_FILES),
+            'indexed_content': self.redis_client.scard(self.config.SET_INDEXED_CONTENT),
+            'sample_stream': self.redis_client.xlen(self.config.STREAM_CODE_SAMPLES),
         }
 
+    def push_code_samples(self, samples: List[CodeSample]):
+        """Append code samples to the indexing stream in one round-trip"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for sample in samples:
+            pipe.xadd(self.config.STREAM_CODE_SAMPLES, {'sample': orjson.dumps(sample)})
+        pipe.execute()
+
+    def code_sample_backlog(self) -> int:
+        """Number of code samples waiting in the indexing stream"""
+        return self.redis_client.xlen(self.config.STREAM_CODE_SAMPLES)
+
+    def ensure_sample_group(self):
+        """Create the indexer consumer group (and the stream) if missing"""
+        try:
+            self.redis_client.xgroup_create(
+                self.config.STREAM_CODE_SAMPLES, self.config.STREAM_INDEXER_GROUP, id='0', mkstream=True
+            )
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read_code_samples(self, consumer: str, count: int, block_ms: int,
+                          pending: bool = False) -> List[Tuple[str, CodeSample]]:
+        """Read (entry id, sample) pairs for a consumer; pending re-reads its unacked entries"""
+        result = self.redis_client.xreadgroup(
+            self.config.STREAM_INDEXER_GROUP,
+            consumer,
+            {self.config.STREAM_CODE_SAMPLES: '0' if pending else '>'},
+            count=count,
+            block=None if pending else block_ms,
+        )
+        if not result:
+            return []
+        _, entries = result[0]
+
+        samples = []
+        unreadable = []
+        for entry_id, fields in entries:
+            # Pending entries deleted from the stream come back without fields
+            if not fields:
+                unreadable.append(entry_id)
+                continue
+            try:
+                samples.append((entry_id, CodeSample(**orjson.loads(fields['sample']))))
+            except (KeyError, TypeError, orjson.JSONDecodeError) as e:
+                # Retrying can never decode it, so park it instead of blocking the consumer
+                self.move_to_dead_letter(fields, e, 'samples')
+                unreadable.append(entry_id)
+        if unreadable:
+            self.ack_code_samples(unreadable)
+        return samples
+
+    def delivery_counts(self, consumer: str, first_id: str, last_id: str, count: int) -> Dict[str, int]:
+        """Times each of a consumer's pending entries in [first_id, last_id] was delivered"""
+        pending = self.redis_client.xpending_range(
+            self.config.STREAM_CODE_SAMPLES, self.config.STREAM_INDEXER_GROUP,
+            min=first_id, max=last_id, count=count, consumername=consumer,
+        )
+        return {entry['message_id']: entry['times_delivered'] for entry in pending}
+
+    def claim_idle_samples(self, consumer: str, min_idle_ms: int, count: int) -> int:
+        """Take over entries left pending by consumers that stopped; returns how many"""
+        # JUSTID: ownership moves without counting a delivery; the consumer reads them
+        # through its pending list next
+        claimed = self.redis_client.xautoclaim(
+            self.config.STREAM_CODE_SAMPLES, self.config.STREAM_INDEXER_GROUP, consumer,
+            min_idle_time=min_idle_ms, start_id='0-0', count=count, justid=True,
+        )
+        return len(claimed)
+
+    def ack_code_samples(self, entry_ids: List[str]):
+        """Acknowledge indexed samples and drop them from the stream"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.xack(self.config.STREAM_CODE_SAMPLES, self.config.STREAM_INDEXER_GROUP, *entry_ids)
+        pipe.xdel(self.config.STREAM_CODE_SAMPLES, *entry_ids)
+        pipe.execute()
+
+    def push_metadata_retry(self, rows: List[Tuple]):
+        """Park metadata rows for a later PostgreSQL COPY"""
+        if rows:
+            self.redis_client.rpush(self.config.QUEUE_METADATA_RETRY, *[orjson.dumps(row) for row in rows])
+
+    def pop_metadata_retry(self, count: int) -> List[Tuple]:
+        """Take up to count parked metadata rows"""
+        rows = self.redis_client.lpop(self.config.QUEUE_METADATA_RETRY, count)
+        return [tuple(orjson.loads(row)) for row in rows or []]
+
     def enqueue_repo_priority(self, job: RepoJob, priority: str = 'normal') -> bool:
         """Add repository to priority queue"""
         if self.is_repo_processed(job.full_name):
@@ -291,24 +492,24 @@ class RedisQueueManager:
         }
 
         queue = queue_map.get(priority, self.config.QUEUE_REPOS_NORMAL)
-        self.redis_client.rpush(queue, job.to_json())
+        self.raw_client.rpush(queue, job.to_payload(self.config.SERIALIZER))
         logger.info(f"Enqueued repo to {priority} priority: {job.full_name}")
         return True
 
     def dequeue_repo_priority(self, timeout: int = 1) -> Optional[RepoJob]:
         """Dequeue from highest priority queue first"""
         for queue in [self.config.QUEUE_REPOS_HIGH, self.config.QUEUE_REPOS_NORMAL, self.config.QUEUE_REPOS_LOW]:
-            result = self.redis_client.blpop(queue, timeout=timeout)
+            result = self.raw_client.blpop(queue, timeout=timeout)
             if result:
                 _, data = result
-                return RepoJob.from_json(data)
+                return RepoJob.from_payload(data)
         # Fallback to regular queue for backward compatibility
         return self.dequeue_repo(timeout=0)
 
     def move_to_dead_letter(self, job: any, error: Exception, queue_name: str):
         """Move failed job to dead letter queue"""
         dead_letter_entry = {
-            'job': asdict(job) if hasattr(job, '__dataclass_fields__') else str(job),
+            'job': asdict(job) if hasattr(job, '__dataclass_fields__') else job if isinstance(job, dict) else str(job),
             'error': str(error),
             'error_type': type(error).__name__,
             'queue': queue_name,
@@ -318,7 +519,7 @@ class RedisQueueManager:
 
         self.redis_client.rpush(
             self.config.QUEUE_DEAD_LETTER,
-            json.dumps(dead_letter_entry)
+            orjson.dumps(dead_letter_entry)
         )
         logger.error(f"Moved job to dead letter queue: {dead_letter_entry}")
 
@@ -339,24 +540,49 @@ class RedisQueueManager:
 # ELASTICSEARCH MANAGER
 # ============================================================================
 
+class OrjsonSerializer(JsonSerializer):
+    """Elasticsearch JSON serializer backed by orjson"""
+
+    def dumps(self, data) -> bytes:
+        # Pre-encoded bodies pass straight through
+        if isinstance(data, (str, bytes)):
+            return super().dumps(data)
+        return orjson.dumps(data, default=self.default)
+
+    def loads(self, data: bytes):
+        # Some responses carry a JSON content type with an empty body
+        if data == b'':
+            return None
+        return orjson.loads(data)
+
 class ElasticsearchManager:
     """Manages Elasticsearch indexing and search"""
 
     def __init__(self, config: PipelineConfig):
         self.config = config
-        self.es = Elasticsearch([config.ES_HOST], request_timeout=30)
+        self.es = Elasticsearch([config.ES_HOST], request_timeout=30, serializer=OrjsonSerializer())
         logger.info(f"Connected to Elasticsearch at {config.ES_HOST}")
         self._create_indices()
 
     def _create_indices(self):
         """Create Elasticsearch indices with mappings"""
 
+        # Bulk-ingest tuning: nothing needs near-real-time search while the index fills, so
+        # refresh rarely and fsync the translog in the background, not on every bulk request
+        ingest_settings = {
+            "index.refresh_interval": "30s",
+            "index.translog.durability": "async",
+            "index.translog.sync_interval": "30s",
+            "index.translog.flush_threshold_size": "1gb",
+        }
+
         # Code index mapping
         code_mapping = {
             "mappings": {
                 "properties": {
                     "id": {"type": "keyword"},
-                    "content": {"type": "text", "analyzer": "standard"},
+                    # Matches are filtered and sorted on quality, never ranked by length
+                    "content": {"type": "text", "analyzer": "standard", "norms": False},
                     "language": {"type": "keyword"},
                     "file_path": {"type": "keyword"},
                     "repo_full_name": {"type": "keyword"},
@@ -373,31 +599,51 @@ class ElasticsearchManager:
                 "number_of_shards": 1,
                 "number_of_replicas": 0,
                 "index.max_result_window": 50000,
+                "index.codec": "best_compression",  # Source code compresses well
+                **ingest_settings,
             }
         }
 
+        # Indices matching the code index name (e.g. rolled or reindexed copies) inherit
+        # the same settings and mapping
+        self.es.indices.put_index_template(
+            name=f"{self.config.ES_INDEX_CODE}-template",
+            index_patterns=[f"{self.config.ES_INDEX_CODE}*"],
+            template=code_mapping,
+        )
+
         # Create code index
         if not self.es.indices.exists(index=self.config.ES_INDEX_CODE):
             self.es.indices.create(index=self.config.ES_INDEX_CODE, body=code_mapping)
             logger.info(f"Created index: {self.config.ES_INDEX_CODE}")
+        else:
+            # The codec and norms only apply at creation; the ingest settings are dynamic
+            self.es.indices.put_settings(index=self.config.ES_INDEX_CODE, settings=ingest_settings)
 
     def index_code_sample(self, sample: CodeSample) -> bool:
         """Index a code sample"""
         try:
-            self.es.index(
+            self.es.create(
                 index=self.config.ES_INDEX_CODE,
                 id=sample.id,
                 document=sample.to_dict()
             )
             return True
+        except ConflictError:
+            # Same content is already indexed
+            return True
         except Exception as e:
             logger.error(f"Failed to index code sample {sample.id}: {e}")
             return False
 
-    def bulk_index_code_samples(self, samples: List[CodeSample]) -> int:
-        """Bulk index code samples"""
+    def bulk_index_code_samples(self, samples: List[CodeSample]) -> Tuple[List[str], Dict[str, str]]:
+        """Bulk index code samples; returns the ids now in the index and the ids ES rejected"""
+        # The content hash is the _id, so a redelivered or duplicate sample can never create
+        # a second document; "create" fails with 409 instead of overwriting, which we count
+        # as indexed
         actions = [
             {
+                "_op_type": "create",
                 "_index": self.config.ES_INDEX_CODE,
                 "_id": sample.id,
                 "_source": sample.to_dict()
@@ -406,12 +652,32 @@ class ElasticsearchManager:
         ]
 
         try:
-            success, failed = helpers.bulk(self.es, actions, raise_on_error=False)
-            logger.info(f"Bulk indexed {success} code samples, {len(failed)} failed")
-            return success
+            indexed = []
+            rejected = {}
+            failed = 0
+            for ok, item in helpers.parallel_bulk(
+                self.es,
+                actions,
+                thread_count=self.config.ES_BULK_THREADS,
+                chunk_size=self.config.ES_BULK_CHUNK_SIZE,
+                max_chunk_bytes=self.config.ES_BULK_MAX_CHUNK_BYTES,
+                queue_size=self.config.ES_BULK_THREADS * 2,
+                raise_on_error=False,
+            ):
+                result = item['create']
+                if ok or result.get('status') == 409:
+                    indexed.append(result['_id'])
+                else:
+                    failed += 1
+                    # 429 means ES is overloaded, which retrying fixes; anything else is
+                    # a problem with the document itself
+                    if result.get('status') != 429:
+                        rejected[result['_id']] = str(result.get('error'))
+            logger.info(f"Bulk indexed {len(indexed)} code samples, {failed} failed")
+            return indexed, rejected
         except Exception as e:
             logger.error(f"Bulk indexing failed: {e}")
-            return 0
+            return [], {}
 
     def search_high_quality_code(self, min_quality: float = 0.7, limit: int = 10000) -> List[Dict]:
         """Search for high-quality code samples"""
@@ -437,15 +703,164 @@ class ElasticsearchManager:
             logger.error(f"Search failed: {e}")
             return []
 
+# ============================================================================
+# POSTGRESQL METADATA STORE
+# ============================================================================
+
+class PostgresMetadataStore:
+    """Persists code sample metadata to PostgreSQL"""
+
+    CREATE_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS code_samples (
+            id TEXT NOT NULL,
+            repo_full_name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            language TEXT NOT NULL,
+            lines_of_code INTEGER NOT NULL,
+            quality_score REAL NOT NULL,
+            indexed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (id, repo_full_name, file_path)
+        )
+    """
+
+    # COPY can't skip conflicting rows, so batches land in a per-session staging table
+    # and move over with ON CONFLICT DO NOTHING; redelivered batches insert nothing twice
+    CREATE_STAGING_SQL = """
+        CREATE TEMP TABLE IF NOT EXISTS code_samples_staging
+            (LIKE code_samples INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+    """
+
+    COPY_SQL = (
+        "COPY code_samples_staging (id, repo_full_name, file_path, language, lines_of_code, "
+        "quality_score, indexed_at) FROM STDIN WITH (FORMAT csv)"
+    )
+
+    INSERT_SQL = (
+        "INSERT INTO code_samples SELECT * FROM code_samples_staging ON CONFLICT DO NOTHING"
+    )
+
+    def __init__(self, config: PipelineConfig):
+        self.config = config
+        # Created on first use, so each worker process opens its own connections
+        # instead of inheriting sockets across a fork
+        self._pool = None
+        # After a failure, calls fail fast until this time instead of each waiting on a
+        # connect to an unreachable server
+        self._retry_at = 0.0
+
+    def _get_pool(self) -> pool.ThreadedConnectionPool:
+        """Return the connection pool, creating it and the table on first use"""
+        if self._pool is None:
+            pg_pool = pool.ThreadedConnectionPool(
+                self.config.DB_POOL_MIN,
+                self.config.DB_POOL_MAX,
+                host=self.config.DB_HOST,
+                port=self.config.DB_PORT,
+                dbname=self.config.DB_NAME,
+                user=self.config.DB_USER,
+                password=self.config.DB_PASSWORD,
+                connect_timeout=self.config.PG_CONNECT_TIMEOUT,
+            )
+            try:
+                conn = pg_pool.getconn()
+                with conn, conn.cursor() as cur:
+                    cur.execute(self.CREATE_TABLE_SQL)
+                pg_pool.putconn(conn)
+            except Exception:
+                pg_pool.closeall()
+                raise
+            self._pool = pg_pool
+            logger.info(f"Connected to PostgreSQL at {self.config.DB_HOST}:{self.config.DB_PORT}")
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; commits on success, rolls back on error"""
+        conn = self._get_pool().getconn()
+        try:
+            with conn:
+                yield conn
+        finally:
+            # Broken connections are dropped rather than handed out again
+            self._pool.putconn(conn, close=bool(conn.closed))
+
+    @staticmethod
+    def metadata_row(sample: CodeSample) -> Tuple:
+        """Row of a sample in the code_samples column order"""
+        return (sample.id, sample.repo_full_name, sample.file_path, sample.language,
+                sample.lines_of_code, sample.quality_score, sample.indexed_at)
+
+    def copy_code_samples(self, samples: List[CodeSample]) -> bool:
+        """Write sample metadata with one COPY instead of a row-at-a-time INSERT; True once stored"""
+        return self.copy_rows([self.metadata_row(sample) for sample in samples])
+
+    def copy_rows(self, rows: List[Tuple]) -> bool:
+        """COPY metadata rows built by metadata_row; True once stored"""
+        if time.monotonic() < self._retry_at:
+            return False
+
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator='\n').writerows(rows)
+        buf.seek(0)
+
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(self.CREATE_STAGING_SQL)
+                cur.copy_expert(self.COPY_SQL, buf)
+                cur.execute(self.INSERT_SQL)
+            return True
+        except Exception as e:
+            logger.error(f"Metadata COPY failed, pausing PostgreSQL writes for {self.config.PG_RETRY_INTERVAL}s: {e}")
+            self._retry_at = time.monotonic() + self.config.PG_RETRY_INTERVAL
+            return False
+
 # ============================================================================
 # CODE QUALITY ANALYZER
 # ============================================================================
 
+def _comment_line_regex(markers: List[str], docstring: bool = False) -> re.Pattern:
+    """Compile a multiline regex matching lines that start with a comment marker"""
+    # [^\S\n] is \s without the newline, so a match never runs onto the next line
+    regex = r'^[^\S\n]*(?:' + '|'.join(markers) + ')'
+    if docstring:
+        # Comment lines that also contain a docstring delimiter anywhere on the line
+        regex = r'^(?=[^\n]*(?:"""|\'\'\'|/\*\*))' + regex[1:]
+    return re.compile(regex, re.MULTILINE)
+
 class CodeQualityAnalyzer:
     """Analyzes code quality"""
 
-    @staticmethod
-    def analyze(content: str, language: str) -> Dict:
+    # Comment markers that may start a line, after indentation
+    COMMENT_MARKERS = {
+        'Python': ['#', '"""', "'''"],
+        'JavaScript': ['//', r'/\*'],
+        'TypeScript': ['//', r'/\*'],
+        'Rust': ['//', r'/\*'],
+        'Go': ['//', r'/\*'],
+        'Java': ['//', r'/\*'],
+        'C++': ['//', r'/\*'],
+        'C': ['//', r'/\*'],
+    }
+    DEFAULT_COMMENT_MARKERS = ['//']
+
+    # Compiled once at class creation: one regex scan per file instead of a Python loop
+    # over every line and pattern
+    _COMMENT_RE = {lang: _comment_line_regex(markers) for lang, markers in COMMENT_MARKERS.items()}
+    _DOCSTRING_RE = {
+        lang: _comment_line_regex(markers, docstring=True) for lang, markers in COMMENT_MARKERS.items()
+    }
+    _DEFAULT_COMMENT_RE = _comment_line_regex(DEFAULT_COMMENT_MARKERS)
+    _DEFAULT_DOCSTRING_RE = _comment_line_regex(DEFAULT_COMMENT_MARKERS, docstring=True)
+
+    # Counted as plain substrings; a str.count pass per indicator measured faster than
+    # a single regex alternation over the file
+    COMPLEXITY_INDICATORS = (
+        'if ', 'else', 'elif', 'for ', 'while ', 'switch', 'case ',
+        'try', 'catch', 'except', 'async', 'await', 'match'
+    )
+
+    @classmethod
+    def analyze(cls, content: str, language: str) -> Dict:
         """Analyze code quality"""
         lines = content.split('\n')
         non_empty_lines = [l for l in lines if l.strip()]
@@ -455,37 +870,13 @@ class CodeQualityAnalyzer:
         file_size = len(content)
 
         # Comment detection
-        comment_patterns = {
-            'Python': [r'^\s*#', r'^\s*"""', r"^\s*'''"],
-            'JavaScript': [r'^\s*//', r'^\s*/\*'],
-            'TypeScript': [r'^\s*//', r'^\s*/\*'],
-            'Rust': [r'^\s*//', r'^\s*/\*'],
-            'Go': [r'^\s*//', r'^\s*/\*'],
-            'Java': [r'^\s*//', r'^\s*/\*'],
-            'C++': [r'^\s*//', r'^\s*/\*'],
-            'C': [r'^\s*//', r'^\s*/\*'],
-        }
-
-        has_comments = False
-        has_docstrings = False
-        comment_lines = 0
-
-        patterns = comment_patterns.get(language, [r'^\s*//'])
-        for line in lines:
-            for pattern in patterns:
-                if re.match(pattern, line):
-                    comment_lines += 1
-                    has_comments = True
-                    if '"""' in line or "'''" in line or '/**' in line:
-                        has_docstrings = True
-                    break
+        comment_lines = len(cls._COMMENT_RE.get(language, cls._DEFAULT_COMMENT_RE).findall(content))
+        has_comments = comment_lines > 0
+        has_docstrings = bool(cls._DOCSTRING_RE.get(language, cls._DEFAULT_DOCSTRING_RE).search(content))
 
         # Complexity score (simple heuristic)
-        complexity_indicators = [
-            'if ', 'else', 'elif', 'for ', 'while ', 'switch', 'case ',
-            'try', 'catch', 'except', 'async', 'await', 'match'
-        ]
-        complexity_count = sum(content.lower().count(indicator) for indicator in complexity_indicators)
+        lowered = content.lower()
+        complexity_count = sum(lowered.count(indicator) for indicator in cls.COMPLEXITY_INDICATORS)
         complexity_score = min(complexity_count / (lines_of_code + 1), 1.0)
 
         # Quality score calculation
@@ -529,13 +920,82 @@ class CodeQualityAnalyzer:
 # WORKERS
 # ============================================================================
 
-def repo_download_worker(worker_id: int, config: PipelineConfig):
-    """Worker that downloads repositories"""
+def iter_source_files(repo_path: Path, config: PipelineConfig) -> Iterator[Tuple[Path, str, int]]:
+    """Yield (path, language, size) for each target-language file in a cloned repo"""
+    # Excluded directories are pruned as a whole rather than testing every file's path
+    # parts; symlinks are not followed, so a repo cannot point the walk outside itself
+    stack = [str(repo_path)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in config.EXCLUDE_PATHS:
+                        stack.append(entry.path)
+                    continue
+
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+
+                # Check extension
+                ext = os.path.splitext(entry.name)[1].lower()
+                if ext not in config.TARGET_LANGUAGES or ext in config.EXCLUDE_EXTENSIONS:
+                    continue
+
+                try:
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+
+                yield Path(entry.path), config.TARGET_LANGUAGES[ext], size
+
+def clone_repo(repo_url: str, repo_path: Path, config: PipelineConfig) -> bool:
+    """Shallow, sparse clone that downloads only target-language files"""
+    # Partial clone + sparse checkout: blobs are fetched lazily at checkout, and only for
+    # source files; assets, lockfiles and docs never leave the server. Suffixes are
+    # matched case-insensitively later, so upper-case variants are included here.
+    patterns = [p for ext in config.TARGET_LANGUAGES for p in (f'*{ext}', f'*{ext.upper()}')]
+    steps = [
+        ['git', '-c', 'protocol.version=2', 'clone', '--depth=1', '--single-branch', '--no-tags',
+         '--filter=blob:none', '--sparse', '--no-checkout', '--quiet', repo_url, str(repo_path)],
+        ['git', '-C', str(repo_path), 'sparse-checkout', 'set', '--no-cone', *patterns],
+        ['git', '-C', str(repo_path), 'checkout', '--quiet'],
+    ]
+    # Never wait on a credential prompt (private or deleted repos)
+    env = {**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+
+    try:
+        for step in steps:
+            result = subprocess.run(step, capture_output=True, text=True,
+                                    timeout=config.CLONE_TIMEOUT, env=env)
+            if result.returncode != 0:
+                logger.error(f"Failed to clone {repo_url}: {result.stderr.strip()}")
+                break
+        else:
+            return True
+    except subprocess.TimeoutExpired:
+        logger.error(f"Failed to clone {repo_url}: timed out after {config.CLONE_TIMEOUT}s")
+
+    # Don't leave a partial checkout behind; it would be mistaken for a cloned repo
+    shutil.rmtree(repo_path, ignore_errors=True)
+    return False
+
+def repo_download_worker(worker_id: int, config: PipelineConfig,
+                         queue_mgr: Optional[RedisQueueManager] = None,
+                         stop_event: Optional[threading.Event] = None):
+    """Worker that downloads repositories (thread-safe; queue_mgr may be shared)"""
     logger.info(f"Repo worker {worker_id} started")
 
-    queue_mgr = RedisQueueManager(config)
+    if queue_mgr is None:
+        queue_mgr = RedisQueueManager(config)
+    if stop_event is None:
+        stop_event = threading.Event()
 
-    while True:
+    while not stop_event.is_set():
         try:
             # Get job from queue
             job = queue_mgr.dequeue_repo(timeout=5)
@@ -549,45 +1009,18 @@ def repo_download_worker(worker_id: int, config: PipelineConfig):
             if repo_path.exists():
                 logger.info(f"Repo already exists: {job.full_name}")
             else:
-                try:
-                    repo_path.parent.mkdir(parents=True, exist_ok=True)
-                    git.Repo.clone_from(
-                        job.repo_url,
-                        repo_path,
-                        depth=1,
-                        single_branch=True
-                    )
-                    logger.info(f"Cloned repo: {job.full_name}")
-                except Exception as e:
-                    logger.error(f"Failed to clone {job.full_name}: {e}")
-                    continue
-
-            # Scan for files and enqueue
-            enqueued = 0
-            for file_path in repo_path.rglob('*'):
-                if not file_path.is_file():
-                    continue
-
-                # Check if in excluded paths
-                if any(excluded in file_path.parts for excluded in config.EXCLUDE_PATHS):
-                    continue
-
-                # Check extension
-                ext = file_path.suffix.lower()
-                if ext not in config.TARGET_LANGUAGES:
-                    continue
-
-                if ext in config.EXCLUDE_EXTENSIONS:
+                repo_path.parent.mkdir(parents=True, exist_ok=True)
+                if not clone_repo(job.repo_url, repo_path, config):
                     continue
+                logger.info(f"Cloned repo: {job.full_name}")
 
+            # Scan for files, then enqueue them in batches
+            file_jobs = []
+            for file_path, language, file_size in iter_source_files(repo_path, config):
                 # Check file size
-                try:
-                    file_size = file_path.stat().st_size
-                    if file_size < config.MIN_FILE_SIZE_BYTES:
-                        continue
-                    if file_size > config.MAX_FILE_SIZE_KB * 1024:
-                        continue
-                except:
+                if file_size < config.MIN_FILE_SIZE_BYTES:
+                    continue
+                if file_size > config.MAX_FILE_SIZE_KB * 1024:
                     continue
 
                 # Create file job
@@ -595,13 +1028,13 @@ def repo_download_worker(worker_id: int, config: PipelineConfig):
                     repo_full_name=job.full_name,
                     file_path=str(file_path),
                     file_relative_path=str(file_path.relative_to(repo_path)),
-                    language=config.TARGET_LANGUAGES[ext],
+                    language=language,
                     file_size=file_size
                 )
 
-                if queue_mgr.enqueue_file(file_job):
-                    enqueued += 1
+                file_jobs.append(file_job)
 
+            enqueued = queue_mgr.enqueue_files_batch(file_jobs)
             logger.info(f"Worker {worker_id}: Enqueued {enqueued} files from {job.full_name}")
 
             # Mark repo as processed
@@ -619,7 +1052,6 @@ def file_processor_worker(worker_id: int, config: PipelineConfig):
     logger.info(f"File worker {worker_id} started")
 
     queue_mgr = RedisQueueManager(config)
-    es_mgr = ElasticsearchManager(config)
     analyzer = CodeQualityAnalyzer()
 
     # Initialize security scanners
@@ -628,7 +1060,22 @@ def file_processor_worker(worker_id: int, config: PipelineConfig):
     license_checker = LicenseChecker()
 
     batch = []
-    batch_size = 50
+    batch_size = config.STREAM_BATCH_SIZE
+    last_flush = time.monotonic()
+    processed_files = []  # (repo_full_name, file_relative_path) to mark on the next flush
+
+    def flush_batch():
+        """Hand the buffered samples to the index workers, then mark their files processed"""
+        if batch:
+            # Backpressure: wait while the indexers are far behind instead of growing
+            # the stream without bound
+            while queue_mgr.code_sample_backlog() > config.STREAM_MAX_BACKLOG:
+                logger.warning(f"Worker {worker_id}: indexing backlog over {config.STREAM_MAX_BACKLOG}, waiting")
+                time.sleep(config.ES_BULK_FLUSH_INTERVAL)
+            queue_mgr.push_code_samples(batch)
+            batch.clear()
+        queue_mgr.mark_files_processed(processed_files)
+        processed_files.clear()
 
     # Stats tracking
     stats = {
@@ -637,6 +1084,7 @@ def file_processor_worker(worker_id: int, config: PipelineConfig):
         'skipped_malicious': 0,
         'skipped_secrets': 0,
         'skipped_license': 0,
+        'skipped_duplicate': 0,
     }
 
     while True:
@@ -645,17 +1093,21 @@ def file_processor_worker(worker_id: int, config: PipelineConfig):
             job = queue_mgr.dequeue_file(timeout=5)
             if not job:
                 # Flush batch if timeout
-                if batch:
-                    es_mgr.bulk_index_code_samples(batch)
-                    batch = []
+                flush_batch()
+                last_flush = time.monotonic()
                 continue
 
             logger.debug(f"Worker {worker_id}: Processing file {job.file_relative_path}")
 
-            # Read file content
+            # Read file content as bytes: the hash works on them directly and the text is
+            # decoded once, instead of decoding in a text-mode read and re-encoding to hash
             try:
-                with open(job.file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
+                with open(job.file_path, 'rb') as f:
+                    raw = f.read()
+                # Same newline handling as a text-mode read
+                if b'\r' in raw:
+                    raw = raw.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+                content = raw.decode('utf-8', errors='ignore')
             except Exception as e:
                 logger.error(f"Failed to read {job.file_path}: {e}")
                 # Try to retry or move to dead letter queue
@@ -702,9 +1154,18 @@ def file_processor_worker(worker_id: int, config: PipelineConfig):
                 stats['skipped_license'] += 1
                 continue
 
+            # Identical content from another file or repo is indexed only once. BLAKE3 is
+            # SIMD-accelerated and several times faster than MD5 on large files; 16 bytes
+            # keeps the same 32-hex-char shape. The hash is also the ES _id, so content
+            # that races past this check still lands in one document
+            content_hash = blake3.blake3(raw).hexdigest(length=16)
+            if queue_mgr.is_content_indexed(content_hash):
+                stats['skipped_duplicate'] += 1
+                processed_files.append((job.repo_full_name, job.file_relative_path))
+                continue
+
             # All safeguards passed - create code sample
             stats['processed'] += 1
-            content_hash = hashlib.md5(content.encode()).hexdigest()
             sample = CodeSample(
                 id=content_hash,
                 content=content,
@@ -720,16 +1181,14 @@ def file_processor_worker(worker_id: int, config: PipelineConfig):
                 indexed_at=datetime.utcnow().isoformat()
             )
 
-            # Add to batch
+            # Add to batch; the file is marked processed when the batch is flushed
             batch.append(sample)
+            processed_files.append((job.repo_full_name, job.file_relative_path))
 
-            # Flush batch if full
-            if len(batch) >= batch_size:
-                es_mgr.bulk_index_code_samples(batch)
-                batch = []
-
-            # Mark file as processed
-            queue_mgr.mark_file_processed(job.repo_full_name, job.file_relative_path)
+            # Flush batch if full, or if it has been waiting too long on a slow queue
+            if len(batch) >= batch_size or time.monotonic() - last_flush >= config.ES_BULK_FLUSH_INTERVAL:
+                flush_batch()
+                last_flush = time.monotonic()
 
             # Log stats periodically (every 100 files)
             total_checked = sum(stats.values())
@@ -740,20 +1199,114 @@ def file_processor_worker(worker_id: int, config: PipelineConfig):
                     f"skipped_quality={stats['skipped_low_quality']}, "
                     f"skipped_malicious={stats['skipped_malicious']}, "
                     f"skipped_secrets={stats['skipped_secrets']}, "
-                    f"skipped_license={stats['skipped_license']}"
+                    f"skipped_license={stats['skipped_license']}, "
+                    f"skipped_duplicate={stats['skipped_duplicate']}"
                 )
 
         except KeyboardInterrupt:
             logger.info(f"Worker {worker_id} shutting down")
             logger.info(f"Final stats: {stats}")
             # Flush remaining batch
-            if batch:
-                es_mgr.bulk_index_code_samples(batch)
+            flush_batch()
             break
         except Exception as e:
             logger.error(f"Worker {worker_id} error: {e}", exc_info=True)
             time.sleep(1)
 
+def index_worker(worker_id: int, config: PipelineConfig):
+    """Worker that drains the code sample stream into Elasticsearch and PostgreSQL"""
+    logger.info(f"Index worker {worker_id} started")
+
+    queue_mgr = RedisQueueManager(config)
+    es_mgr = ElasticsearchManager(config)
+    pg_store = PostgresMetadataStore(config) if config.PG_METADATA_ENABLED else None
+    queue_mgr.ensure_sample_group()
+
+    # A stable consumer name lets a restarted worker pick up the entries it had read but
+    # not acknowledged; those are drained first, then new entries
+    consumer = f"indexer-{worker_id}"
+    pending = True
+    # Entries of consumers that no longer run (e.g. INDEX_WORKERS was lowered) are only
+    # reachable by claiming them; check at start, then every STREAM_CLAIM_INTERVAL
+    next_claim = 0.0
+    # Metadata rows parked while PostgreSQL was unavailable are retried on this schedule
+    next_metadata_retry = 0.0
+
+    while True:
+        try:
+            if time.monotonic() >= next_claim:
+                claimed = queue_mgr.claim_idle_samples(consumer, config.STREAM_CLAIM_IDLE_MS, config.ES_BULK_BATCH_SIZE)
+                # A full claim may have left more behind, so look again on the next pass
+                if claimed < config.ES_BULK_BATCH_SIZE:
+                    next_claim = time.monotonic() + config.STREAM_CLAIM_INTERVAL
+                if claimed:
+                    logger.info(f"Index worker {worker_id} claimed {claimed} idle samples")
+                    pending = True
+
+            if pg_store and time.monotonic() >= next_metadata_retry:
+                rows = queue_mgr.pop_metadata_retry(config.ES_BULK_BATCH_SIZE)
+                if rows and not pg_store.copy_rows(rows):
+                    queue_mgr.push_metadata_retry(rows)
+                elif len(rows) == config.ES_BULK_BATCH_SIZE:
+                    # More may be parked; keep draining while PostgreSQL takes them
+                    continue
+                next_metadata_retry = time.monotonic() + config.PG_RETRY_INTERVAL
+
+            entries = queue_mgr.read_code_samples(
+                consumer,
+                count=config.ES_BULK_BATCH_SIZE,
+                block_ms=int(config.ES_BULK_FLUSH_INTERVAL * 1000),
+                pending=pending,
+            )
+            if not entries:
+                pending = False
+                continue
+
+            indexed, rejected = es_mgr.bulk_index_code_samples([sample for _, sample in entries])
+            indexed = set(indexed)
+            done = [(entry_id, sample) for entry_id, sample in entries if sample.id in indexed]
+
+            # Samples ES rejects outright go to the dead-letter list once they have used up
+            # their deliveries; the rest stay pending for another try
+            poisoned = []
+            if rejected:
+                deliveries = queue_mgr.delivery_counts(consumer, entries[0][0], entries[-1][0], len(entries))
+                poisoned = [
+                    (entry_id, sample) for entry_id, sample in entries
+                    if sample.id in rejected and deliveries.get(entry_id, 0) >= config.STREAM_MAX_DELIVERIES
+                ]
+
+            if done:
+                # Only content Elasticsearch accepted is marked, so lost samples are not
+                # mistaken for duplicates later
+                queue_mgr.mark_content_indexed(list(indexed))
+                if pg_store:
+                    rows = [pg_store.metadata_row(sample) for _, sample in done]
+                    if not pg_store.copy_rows(rows):
+                        # The metadata table is optional, so an outage must not hold up the
+                        # stream: park the rows for a later COPY and ack the entries anyway
+                        queue_mgr.push_metadata_retry(rows)
+
+            for _, sample in poisoned:
+                # The file can be re-read from its repo, so the entry skips the content
+                entry = {key: value for key, value in sample.to_dict().items() if key != 'content'}
+                queue_mgr.move_to_dead_letter(entry, RuntimeError(rejected[sample.id]), 'samples')
+            if done or poisoned:
+                queue_mgr.ack_code_samples([entry_id for entry_id, _ in done + poisoned])
+
+            if len(done) + len(poisoned) < len(entries):
+                # Some samples were not indexed (e.g. ES unreachable): their entries stay
+                # pending and are retried after a pause
+                pending = True
+                time.sleep(config.RETRY_DELAY_BASE)
+
+        except KeyboardInterrupt:
+            logger.info(f"Index worker {worker_id} shutting down")
+            break
+        except Exception as e:
+            logger.error(f"Index worker {worker_id} error: {e}", exc_info=True)
+            time.sleep(1)
+
 # ============================================================================
 # MAIN ORCHESTRATOR
 # ============================================================================
@@ -764,25 +1317,38 @@ def main():
 
     config = PipelineConfig()
 
-    # Start repo download workers
-    repo_workers = []
-    for i in range(config.REPO_WORKERS):
-        p = mp.Process(target=repo_download_worker, args=(i, config))
-        p.start()
-        repo_workers.append(p)
-
-    # Start file processor workers
+    # Start file processor workers first, so they fork before any threads or sockets
+    # exist here; analysis and security scans hold the GIL, so these stay processes
     file_workers = []
     for i in range(config.FILE_WORKERS):
         p = mp.Process(target=file_processor_worker, args=(i, config))
         p.start()
         file_workers.append(p)
 
-    logger.info(f"Started {len(repo_workers)} repo workers and {len(file_workers)} file workers")
+    # Start index workers, which move samples from the stream into Elasticsearch
+    index_workers = []
+    for i in range(config.INDEX_WORKERS):
+        p = mp.Process(target=index_worker, args=(i, config))
+        p.start()
+        index_workers.append(p)
 
     # Monitor queues
     queue_mgr = RedisQueueManager(config)
 
+    # Start repo download workers: cloning and scanning wait on git and the disk, so they
+    # run as threads sharing the monitor's Redis connection pool
+    stop_event = threading.Event()
+    repo_pool = ThreadPoolExecutor(max_workers=config.REPO_WORKERS, thread_name_prefix="repo-worker")
+    repo_workers = [
+        repo_pool.submit(repo_download_worker, i, config, queue_mgr, stop_event)
+        for i in range(config.REPO_WORKERS)
+    ]
+
+    logger.info(
+        f"Started {len(repo_workers)} repo workers, {len(file_workers)} file workers "
+        f"and {len(index_workers)} index workers"
+    )
+
     try:
         while True:
             time.sleep(30)
@@ -791,13 +1357,16 @@ def main():
     except KeyboardInterrupt:
         logger.info("Shutting down pipeline...")
 
-        # Terminate workers
-        for p in repo_workers + file_workers:
+        # Terminate workers; repo threads exit after their current job
+        stop_event.set()
+        for p in file_workers + index_workers:
             p.terminate()
 
-        for p in repo_workers + file_workers:
+        for p in file_workers + index_workers:
             p.join(timeout=5)
 
+        repo_pool.shutdown(wait=True)
+
         logger.info("Pipeline shut down complete")
 
 if __name__ == "__main__":
@@ -0,0 +1,262 @@
+"""
+Tests for the code sample stream between file workers and index workers
+Covers partial acks, pending re-reads, dead-lettering and claiming orphaned entries
+"""
+
+import pytest
+import sys
+import types
+from pathlib import Path
+
+# data_pipeline_v2 imports its scanners as top-level modules
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "src" / "python" / "utils"))
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "src" / "python" / "processors"))
+
+# Third-party modules data_pipeline_v2 imports at module level
+for module in ("blake3", "redis", "elasticsearch", "psycopg2"):
+    pytest.importorskip(module)
+fakeredis = pytest.importorskip("fakeredis")
+orjson = pytest.importorskip("orjson")
+
+# data_pipeline_v2 imports get_tracer and trace_function, which utils/tracing.py does not
+# define, and the real module needs opentelemetry; the stream code uses neither
+tracing_stub = types.ModuleType("tracing")
+tracing_stub.get_tracer = lambda *args, **kwargs: None
+tracing_stub.trace_function = lambda *args, **kwargs: (lambda func: func)
+sys.modules["tracing"] = tracing_stub
+
+import data_pipeline_v2
+from data_pipeline_v2 import CodeSample, PipelineConfig, RedisQueueManager
+
+
+class FakeElasticsearchManager:
+    """Stands in for ElasticsearchManager; fails or rejects chosen sample ids"""
+
+    def __init__(self):
+        self.docs = {}
+        self.failing = set()  # not indexed, no item error (e.g. ES unreachable)
+        self.rejecting = {}  # id -> error, as for a 400 bulk item
+
+    def bulk_index_code_samples(self, samples):
+        indexed, rejected = [], {}
+        for sample in samples:
+            if sample.id in self.rejecting:
+                rejected[sample.id] = self.rejecting[sample.id]
+            elif sample.id not in self.failing:
+                self.docs[sample.id] = sample
+                indexed.append(sample.id)
+        return indexed, rejected
+
+
+def make_sample(i: int) -> CodeSample:
+    """Small sample whose id is unique per i"""
+    return CodeSample(
+        id=f"hash{i:03d}",
+        content=f"def f{i}():\n    return {i}\n",
+        language="Python",
+        file_path=f"src/f{i}.py",
+        repo_full_name="user/project",
+        lines_of_code=2,
+        file_size=30,
+        quality_score=0.8,
+        has_comments=False,
+        has_docstrings=False,
+        complexity_score=0.1,
+        indexed_at="2024-01-01T00:00:00",
+    )
+
+
+@pytest.fixture
+def config():
+    """Pipeline config without PostgreSQL, pauses or long blocking reads"""
+    config = PipelineConfig()
+    config.PG_METADATA_ENABLED = False
+    config.RETRY_DELAY_BASE = 0
+    config.ES_BULK_FLUSH_INTERVAL = 0.01
+    config.STREAM_MAX_DELIVERIES = 3
+    return config
+
+
+@pytest.fixture
+def queue_mgr(config, monkeypatch):
+    """Queue manager whose Redis clients share one in-memory server"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        data_pipeline_v2.redis, "Redis",
+        lambda *args, decode_responses=False, **kwargs: fakeredis.FakeRedis(
+            server=server, decode_responses=decode_responses
+        ),
+    )
+    queue_mgr = RedisQueueManager(config)
+    queue_mgr.ensure_sample_group()
+    return queue_mgr
+
+
+@pytest.fixture
+def es(monkeypatch):
+    """Fake Elasticsearch manager handed to every index worker"""
+    es = FakeElasticsearchManager()
+    monkeypatch.setattr(data_pipeline_v2, "ElasticsearchManager", lambda config: es)
+    return es
+
+
+def run_index_worker(config, monkeypatch, reads: int):
+    """Run index worker 0 until it has attempted the given number of stream reads"""
+    # The worker starts with a read of its own pending entries, which counts here
+    read = RedisQueueManager.read_code_samples
+    calls = {"count": 0}
+
+    def limited_read(self, *args, **kwargs):
+        calls["count"] += 1
+        if calls["count"] > reads:
+            raise KeyboardInterrupt
+        return read(self, *args, **kwargs)
+
+    monkeypatch.setattr(RedisQueueManager, "read_code_samples", limited_read)
+    data_pipeline_v2.index_worker(0, config)
+    monkeypatch.setattr(RedisQueueManager, "read_code_samples", read)
+
+
+def pending_ids(queue_mgr, config):
+    """Entry ids still pending in the indexer group"""
+    pending = queue_mgr.redis_client.xpending_range(
+        config.STREAM_CODE_SAMPLES, config.STREAM_INDEXER_GROUP, min="-", max="+", count=100
+    )
+    return [entry["message_id"] for entry in pending]
+
+
+def stream_samples(queue_mgr, config):
+    """Sample ids of the entries still in the stream"""
+    entries = queue_mgr.redis_client.xrange(config.STREAM_CODE_SAMPLES)
+    return sorted(orjson.loads(fields["sample"])["id"] for _, fields in entries)
+
+
+class TestIndexWorker:
+    """Acking, retrying and dead-lettering in index_worker"""
+
+    def test_all_indexed(self, config, queue_mgr, es, monkeypatch):
+        """A clean batch is indexed, marked and removed from the stream"""
+        queue_mgr.push_code_samples([make_sample(i) for i in range(5)])
+
+        run_index_worker(config, monkeypatch, reads=2)
+
+        assert len(es.docs) == 5
+        assert queue_mgr.redis_client.scard(config.SET_INDEXED_CONTENT) == 5
+        assert queue_mgr.code_sample_backlog() == 0
+        assert pending_ids(queue_mgr, config) == []
+
+    def test_partial_bulk_failure(self, config, queue_mgr, es, monkeypatch):
+        """Only the entries ES did not take stay pending; the rest are acked"""
+        queue_mgr.push_code_samples([make_sample(i) for i in range(5)])
+        es.failing = {"hash001", "hash003"}
+
+        run_index_worker(config, monkeypatch, reads=2)
+
+        assert sorted(es.docs) == ["hash000", "hash002", "hash004"]
+        assert len(pending_ids(queue_mgr, config)) == 2
+        assert stream_samples(queue_mgr, config) == ["hash001", "hash003"]
+        # Failed content is not marked, so it is not taken for a duplicate later
+        assert not queue_mgr.is_content_indexed("hash001")
+
+    def test_pending_entries_retried(self, config, queue_mgr, es, monkeypatch):
+        """Entries left pending are re-read and indexed once ES recovers"""
+        queue_mgr.push_code_samples([make_sample(i) for i in range(5)])
+        es.failing = {"hash001", "hash003"}
+        run_index_worker(config, monkeypatch, reads=2)
+
+        es.failing = set()
+        run_index_worker(config, monkeypatch, reads=3)
+
+        assert len(es.docs) == 5
+        assert queue_mgr.code_sample_backlog() == 0
+        assert pending_ids(queue_mgr, config) == []
+
+    def test_poisoned_entry_dead_lettered(self, config, queue_mgr, es, monkeypatch):
+        """A sample ES keeps rejecting is dead-lettered after STREAM_MAX_DELIVERIES"""
+        queue_mgr.push_code_samples([make_sample(i) for i in range(3)])
+        es.rejecting = {"hash001": "mapper_parsing_exception"}
+
+        run_index_worker(config, monkeypatch, reads=config.STREAM_MAX_DELIVERIES + 2)
+
+        assert sorted(es.docs) == ["hash000", "hash002"]
+        assert queue_mgr.code_sample_backlog() == 0
+        assert pending_ids(queue_mgr, config) == []
+
+        dead = [orjson.loads(entry) for entry in queue_mgr.redis_client.lrange(config.QUEUE_DEAD_LETTER, 0, -1)]
+        assert len(dead) == 1
+        assert dead[0]["job"]["id"] == "hash001"
+        assert dead[0]["error"] == "mapper_parsing_exception"
+        # The content can be re-read from the repo, so it is not copied into the list
+        assert "content" not in dead[0]["job"]
+
+    def test_rejected_entry_retried_before_dead_letter(self, config, queue_mgr, es, monkeypatch):
+        """A rejected sample stays pending while it has deliveries left"""
+        queue_mgr.push_code_samples([make_sample(0)])
+        es.rejecting = {"hash000": "mapper_parsing_exception"}
+
+        # The opening pending read is empty, so this delivers the entry one time too few
+        run_index_worker(config, monkeypatch, reads=config.STREAM_MAX_DELIVERIES)
+
+        assert len(pending_ids(queue_mgr, config)) == 1
+        assert queue_mgr.redis_client.llen(config.QUEUE_DEAD_LETTER) == 0
+
+    def test_dead_consumer_entries_claimed(self, config, queue_mgr, es, monkeypatch):
+        """Entries read by a consumer that stopped are claimed and indexed"""
+        config.STREAM_CLAIM_IDLE_MS = 0
+        queue_mgr.push_code_samples([make_sample(i) for i in range(4)])
+        assert len(queue_mgr.read_code_samples("indexer-9", count=10, block_ms=10)) == 4
+
+        run_index_worker(config, monkeypatch, reads=3)
+
+        assert len(es.docs) == 4
+        assert queue_mgr.code_sample_backlog() == 0
+        assert pending_ids(queue_mgr, config) == []
+
+
+class TestReadCodeSamples:
+    """Stream reads in RedisQueueManager"""
+
+    def test_undecodable_entry_dead_lettered(self, config, queue_mgr):
+        """An entry that can never decode is dead-lettered and dropped, not returned"""
+        queue_mgr.push_code_samples([make_sample(0)])
+        queue_mgr.redis_client.xadd(config.STREAM_CODE_SAMPLES, {"sample": "not json"})
+        queue_mgr.push_code_samples([make_sample(1)])
+
+        samples = queue_mgr.read_code_samples("indexer-0", count=10, block_ms=10)
+
+        assert [sample.id for _, sample in samples] == ["hash000", "hash001"]
+        assert queue_mgr.redis_client.llen(config.QUEUE_DEAD_LETTER) == 1
+        assert queue_mgr.code_sample_backlog() == 2
+        assert len(pending_ids(queue_mgr, config)) == 2
+
+    def test_pending_reread(self, config, queue_mgr):
+        """pending=True returns the consumer's unacked entries again"""
+        queue_mgr.push_code_samples([make_sample(i) for i in range(3)])
+        first = queue_mgr.read_code_samples("indexer-0", count=10, block_ms=10)
+        queue_mgr.ack_code_samples([first[0][0]])
+
+        again = queue_mgr.read_code_samples("indexer-0", count=10, block_ms=10, pending=True)
+
+        assert [sample.id for _, sample in again] == ["hash001", "hash002"]
+        assert queue_mgr.read_code_samples("indexer-0", count=10, block_ms=10) == []
+
+    def test_delivery_counts(self, config, queue_mgr):
+        """Each pending re-read counts as another delivery"""
+        queue_mgr.push_code_samples([make_sample(i) for i in range(2)])
+        entries = queue_mgr.read_code_samples("indexer-0", count=10, block_ms=10)
+        queue_mgr.read_code_samples("indexer-0", count=10, block_ms=10, pending=True)
+
+        counts = queue_mgr.delivery_counts("indexer-0", entries[0][0], entries[-1][0], 10)
+
+        assert counts == {entry_id: 2 for entry_id, _ in entries}
+
+    def test_claim_idle_samples(self, config, queue_mgr):
+        """Claiming moves idle entries to the new consumer without a delivery"""
+        queue_mgr.push_code_samples([make_sample(i) for i in range(3)])
+        entries = queue_mgr.read_code_samples("indexer-9", count=10, block_ms=10)
+
+        assert queue_mgr.claim_idle_samples("indexer-0", min_idle_ms=0, count=10) == 3
+
+        counts = queue_mgr.delivery_counts("indexer-0", entries[0][0], entries[-1][0], 10)
+        assert counts == {entry_id: 1 for entry_id, _ in entries}
+        assert queue_mgr.delivery_counts("indexer-9", entries[0][0], entries[-1][0], 10) == {}
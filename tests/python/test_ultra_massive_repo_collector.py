@@ -0,0 +1,215 @@
+"""
+Tests for the ultra massive repo collector
+Covers token selection in the rate limiter and sharded repository exports
+"""
+
+import orjson
+import pytest
+import time
+
+pytest.importorskip("aiohttp")
+
+from crawlers import ultra_massive_repo_collector as collector
+from crawlers.ultra_massive_repo_collector import AdvancedRateLimiter, UltraMassiveRepoCollector
+
+
+class TestAdvancedRateLimiter:
+    """Tests for heap-based token selection"""
+
+    @pytest.fixture
+    def limiter(self):
+        """Rate limiter over three tokens, without per-request delay"""
+        limiter = AdvancedRateLimiter(["token-a", "token-b", "token-c"])
+        limiter.base_delay = 0.0
+        return limiter
+
+    def set_remaining(self, limiter, remaining, push=True):
+        """Set each token's remaining quota, optionally refreshing the heap"""
+        for idx, value in enumerate(remaining):
+            limiter.token_states[idx].remaining = value
+            if push:
+                limiter._push_token(idx)
+
+    def test_no_tokens(self):
+        """Without tokens there is nothing to hand out"""
+        assert AdvancedRateLimiter([]).get_best_token() == (None, None)
+
+    def test_picks_most_remaining(self, limiter):
+        """The token with the most remaining quota wins"""
+        self.set_remaining(limiter, [100, 4000, 2000])
+
+        assert limiter.get_best_token() == ("token-b", 1)
+
+    def test_skips_failing_tokens(self, limiter):
+        """A token with repeated failures loses to any healthy token"""
+        self.set_remaining(limiter, [100, 4000, 2000])
+        limiter.mark_token_failure(1)
+        limiter.mark_token_failure(1)
+        assert limiter.get_best_token() == ("token-b", 1)
+
+        limiter.mark_token_failure(1)
+        assert limiter.get_best_token() == ("token-c", 2)
+
+    def test_corrects_stale_entries(self, limiter):
+        """Entries left behind by state changes without a push are re-ranked on pop"""
+        self.set_remaining(limiter, [10, 4000, 3000], push=False)
+
+        assert limiter.get_best_token() == ("token-b", 1)
+
+        # The heap now reflects real state, so a later change still ranks correctly
+        self.set_remaining(limiter, [10, 500, 3000], push=False)
+        assert limiter.get_best_token() == ("token-c", 2)
+
+    def test_heap_stays_bounded(self, limiter, monkeypatch):
+        """Superseded entries are compacted rather than piling up"""
+        monkeypatch.setattr(collector.time, "sleep", lambda seconds: None)
+        for _ in range(100):
+            limiter.wait_and_get_token()
+
+        assert len(limiter._token_heap) <= 4 * len(limiter.token_states)
+
+    def test_reserves_quota(self, limiter):
+        """Handing out a token spends one request of its quota"""
+        self.set_remaining(limiter, [100, 4000, 2000])
+
+        assert limiter.wait_and_get_token() == ("token-b", 1)
+        assert limiter.token_states[1].remaining == 3999
+
+    def test_exhausted_tokens_not_reset_early(self, limiter):
+        """Exhausted tokens stay exhausted until their reset time passes"""
+        self.set_remaining(limiter, [0, 0, 0])
+
+        token, idx = limiter.get_best_token()
+
+        assert token is not None
+        assert limiter.token_states[idx].remaining == 0
+
+    def test_exhausted_tokens_wait_for_reset(self, limiter, monkeypatch):
+        """When every token is spent, the limiter sleeps until the earliest reset"""
+        now = time.time()
+        self.set_remaining(limiter, [0, 0, 0])
+        for idx, delay in enumerate([300, 60, 600]):
+            limiter.token_states[idx].reset_time = now + delay
+
+        sleeps = []
+
+        def fake_sleep(seconds):
+            # Move the clock forward by shifting every reset time back
+            sleeps.append(seconds)
+            for state in limiter.token_states.values():
+                state.reset_time -= seconds
+
+        monkeypatch.setattr(collector.time, "sleep", fake_sleep)
+
+        token, idx = limiter.wait_and_get_token()
+
+        assert idx == 1
+        assert 60 <= sleeps[0] <= 62
+        assert limiter.token_states[1].remaining == 4999
+        # Tokens whose reset has not come yet stay exhausted
+        assert limiter.token_states[0].remaining == 0
+        assert limiter.token_states[2].remaining == 0
+
+
+class TestExportRepositories:
+    """Sharded exports must match a single sequential scan byte for byte"""
+
+    @pytest.fixture
+    def collector(self, tmp_path, monkeypatch):
+        """Collector over a temp database with star ties, NULL stars and awkward topics"""
+        monkeypatch.chdir(tmp_path)
+        collector = UltraMassiveRepoCollector([])
+
+        repos = []
+        for i in range(300):
+            repos.append({
+                "html_url": f"https://github.com/owner{i % 7}/repo{i:03d}",
+                "name": f"repo{i:03d}",
+                "owner": {"login": f"owner{i % 7}"},
+                # Few distinct values so star ties straddle shard boundaries
+                "stargazers_count": None if i % 11 == 0 else (i * 37) % 25,
+                "forks_count": i % 5,
+                "language": "Python" if i % 2 else None,
+                "topics": ["python", '"topics":null'] if i % 3 == 0 else [],
+                "created_at": "2020-01-01T00:00:00Z",
+                "updated_at": "2024-01-01T00:00:00Z",
+                "size": i,
+            })
+        # Quotes in other string values are escaped, so they must not be spliced into
+        repos.append({
+            "html_url": "https://github.com/owner/tricky",
+            "name": 'tricky "topics":null',
+            "stargazers_count": 3,
+            "topics": ["tricky"],
+        })
+        collector.save_repositories_batch(repos)
+
+        yield collector
+        collector.close_export_connections()
+
+    def export(self, collector, path, fmt, pretty=False, sharded=True):
+        """Export with many small shards, or as one shard"""
+        collector.export_fetch_rows = 10 if sharded else 1_000_000
+        count = collector.export_repositories(str(path), fmt=fmt, pretty=pretty)
+        return count, path.read_bytes()
+
+    def test_sharding_splits_the_table(self, collector):
+        """The small fetch size really produces several shards"""
+        collector.export_fetch_rows = 10
+        with collector._export_connection() as conn:
+            assert len(collector._export_shards(conn)) > 1
+
+    @pytest.mark.parametrize("fmt,pretty", [("json", False), ("json", True), ("ndjson", False)])
+    def test_sharded_matches_single_shard(self, collector, tmp_path, fmt, pretty):
+        """Output is identical however the star range is split"""
+        single_count, single = self.export(collector, tmp_path / "single", fmt, pretty, sharded=False)
+        sharded_count, sharded = self.export(collector, tmp_path / "sharded", fmt, pretty)
+
+        assert single_count == sharded_count == 301
+        assert sharded == single
+
+    @pytest.mark.parametrize("fmt", ["json", "ndjson"])
+    def test_export_contents(self, collector, tmp_path, fmt):
+        """Rows come out stars-descending with NULLs last and topics intact"""
+        _, data = self.export(collector, tmp_path / "out", fmt)
+        if fmt == "ndjson":
+            rows = [orjson.loads(line) for line in data.splitlines()]
+        else:
+            rows = orjson.loads(data)
+
+        stars = [row["stars"] for row in rows]
+        known = [value for value in stars if value is not None]
+        assert known == sorted(known, reverse=True)
+        assert stars[len(known):] == [None] * (len(stars) - len(known))
+
+        by_name = {row["name"]: row for row in rows}
+        assert by_name["repo000"]["topics"] == ["python", '"topics":null']
+        assert by_name["repo001"]["topics"] == []
+        assert by_name['tricky "topics":null']["topics"] == ["tricky"]
+
+    def test_empty_table(self, tmp_path, monkeypatch):
+        """An empty database still exports valid JSON"""
+        monkeypatch.chdir(tmp_path)
+        collector = UltraMassiveRepoCollector([])
+
+        count, data = self.export(collector, tmp_path / "empty.json", "json")
+        collector.close_export_connections()
+
+        assert count == 0
+        assert orjson.loads(data) == []
+
+    def test_sql_dump_compressed(self, collector, tmp_path):
+        """A .zst SQL dump decompresses to the plain dump"""
+        zstd = pytest.importorskip("zstandard")
+        plain_count, plain = self.export(collector, tmp_path / "dump.sql", "sql")
+        zst_count, compressed = self.export(collector, tmp_path / "dump.sql.zst", "sql")
+
+        assert plain_count == zst_count == 301
+        assert zstd.ZstdDecompressor().decompressobj().decompress(compressed) == plain
+
+    def test_sqlite_backup_rejects_zst(self, collector, tmp_path):
+        """A database backup is not written under a .zst name"""
+        output = tmp_path / "repos.sqlite.zst"
+
+        assert collector.export_repositories(str(output), fmt="sqlite") == 0
+        assert not output.exists()